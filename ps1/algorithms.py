@@ -1,3 +1,4 @@
+import heapq
 import peak
 import trace
 
@@ -22,11 +23,8 @@ def algorithm1(problem, trace = None):
     subproblems.append((subStartR, subStartC1, subNumR, subNumC1))
     subproblems.append((subStartR, subStartC2, subNumR, subNumC2))
 
-    # get a list of all locations in the dividing column
-    divider = crossProduct(range(problem.numRow), [mid])
-
     # find the maximum in the dividing column
-    bestLoc = problem.getMaximum(divider, trace)
+    bestLoc = problem.getLineMaximum(peak.COLUMN, mid, trace)
 
     # see if the maximum value we found on the dividing line has a better
     # neighbor (which cannot be on the dividing line, because we know that
@@ -83,12 +81,7 @@ def algorithm3(problem, bestSeen = None, trace = None):
 
     # find the best location on the cross (the middle row combined with the
     # middle column)
-    cross = []
-
-    cross.extend(crossProduct([midRow], range(problem.numCol)))
-    cross.extend(crossProduct(range(problem.numRow), [midCol]))
-
-    crossLoc = problem.getMaximum(cross, trace)
+    crossLoc = problem.getCrossMaximum(midRow, midCol, trace)
     neighbor = problem.getBetterNeighbor(crossLoc, trace)
 
     # update the best we've seen so far based on this new maximum
@@ -115,7 +108,6 @@ def algorithm4(problem, bestSeen = None, rowSplit = True, trace = None):
         return None
 
     subproblems = []
-    divider = []
 
     if rowSplit:
         # the recursive subproblem will involve half the number of rows
@@ -129,8 +121,8 @@ def algorithm4(problem, bestSeen = None, rowSplit = True, trace = None):
         subproblems.append((subStartR1, subStartC, subNumR1, subNumC))
         subproblems.append((subStartR2, subStartC, subNumR2, subNumC))
 
-        # get a list of all locations in the dividing column
-        divider = crossProduct([mid], range(problem.numCol))
+        # the dividing line is the middle row
+        axis = peak.ROW
     else:
         # the recursive subproblem will involve half the number of columns
         mid = problem.numCol // 2
@@ -143,11 +135,11 @@ def algorithm4(problem, bestSeen = None, rowSplit = True, trace = None):
         subproblems.append((subStartR, subStartC1, subNumR, subNumC1))
         subproblems.append((subStartR, subStartC2, subNumR, subNumC2))
 
-        # get a list of all locations in the dividing column
-        divider = crossProduct(range(problem.numRow), [mid])
+        # the dividing line is the middle column
+        axis = peak.COLUMN
 
     # find the maximum in the dividing row or column
-    bestLoc = problem.getMaximum(divider, trace)
+    bestLoc = problem.getLineMaximum(axis, mid, trace)
     neighbor = problem.getBetterNeighbor(bestLoc, trace)
 
     # update the best we've seen so far based on this new maximum
@@ -170,6 +162,286 @@ def algorithm4(problem, bestSeen = None, rowSplit = True, trace = None):
     return problem.getLocationInSelf(sub, result)
 
 
+################################################################################
+############################# Iterative Algorithms #############################
+################################################################################
+
+# Each of the following functions computes the same result as the algorithm of
+# the same number above, and records exactly the same trace, but it loops over
+# successive subproblems (or locations) instead of recursing.  This keeps the
+# stack depth constant, so long walks cannot exceed Python's recursion limit.
+# Locations are mapped back to the original problem only once, at the end.
+
+def iterativeAlgorithm1(problem, trace = None):
+    original = problem
+
+    while True:
+        # if it's empty, we're done 
+        if problem.numRow <= 0 or problem.numCol <= 0:
+            return None
+
+        # the next subproblem will involve half the number of columns
+        mid = problem.numCol // 2
+
+        # information about the two subproblems
+        (subStartR, subNumR) = (0, problem.numRow)
+        (subStartC1, subNumC1) = (0, mid)
+        (subStartC2, subNumC2) = (mid + 1, problem.numCol - (mid + 1))
+
+        subproblems = []
+        subproblems.append((subStartR, subStartC1, subNumR, subNumC1))
+        subproblems.append((subStartR, subStartC2, subNumR, subNumC2))
+
+        # find the maximum in the dividing column
+        bestLoc = problem.getLineMaximum(peak.COLUMN, mid, trace)
+
+        # see if the maximum value we found on the dividing line has a better
+        # neighbor
+        neighbor = problem.getBetterNeighbor(bestLoc, trace)
+
+        # this is a peak, so return it
+        if neighbor == bestLoc:
+            if not trace is None: trace.foundPeak(bestLoc)
+            return original.getLocationInSelf(problem, bestLoc)
+
+        # otherwise, continue in the half containing the neighbor
+        problem = problem.getSubproblemContaining(subproblems, neighbor)
+        if not trace is None: trace.setProblemDimensions(problem)
+
+def iterativeAlgorithm2(problem, location = (0, 0), trace = None):
+    # if it's empty, we're done 
+    if problem.numRow <= 0 or problem.numCol <= 0:
+        return None
+
+    while True:
+        nextLocation = problem.getBetterNeighbor(location, trace)
+
+        if nextLocation == location:
+            # there is no better neighbor, so return this peak
+            if not trace is None: trace.foundPeak(location)
+            return location
+
+        # there is a better neighbor, so move to the neighbor
+        location = nextLocation
+
+def iterativeAlgorithm3(problem, bestSeen = None, trace = None):
+    original = problem
+
+    while True:
+        # if it's empty, we're done 
+        if problem.numRow <= 0 or problem.numCol <= 0:
+            return None
+
+        midRow = problem.numRow // 2
+        midCol = problem.numCol // 2
+
+        # first, get the list of all subproblems
+        subproblems = []
+
+        (subStartR1, subNumR1) = (0, midRow)
+        (subStartR2, subNumR2) = (midRow + 1, problem.numRow - (midRow + 1))
+        (subStartC1, subNumC1) = (0, midCol)
+        (subStartC2, subNumC2) = (midCol + 1, problem.numCol - (midCol + 1))
+
+        subproblems.append((subStartR1, subStartC1, subNumR1, subNumC1))
+        subproblems.append((subStartR1, subStartC2, subNumR1, subNumC2))
+        subproblems.append((subStartR2, subStartC1, subNumR2, subNumC1))
+        subproblems.append((subStartR2, subStartC2, subNumR2, subNumC2))
+
+        # find the best location on the cross
+        crossLoc = problem.getCrossMaximum(midRow, midCol, trace)
+        neighbor = problem.getBetterNeighbor(crossLoc, trace)
+
+        # update the best we've seen so far based on this new maximum
+        if bestSeen is None or problem.get(neighbor) > problem.get(bestSeen):
+            bestSeen = neighbor
+            if not trace is None: trace.setBestSeen(bestSeen)
+
+        # return if we can't see any better neighbors
+        if neighbor == crossLoc:
+            if not trace is None: trace.foundPeak(crossLoc)
+            return original.getLocationInSelf(problem, crossLoc)
+
+        # continue in the subproblem containing the largest number we've seen
+        sub = problem.getSubproblemContaining(subproblems, bestSeen)
+        bestSeen = sub.getLocationInSelf(problem, bestSeen)
+        if not trace is None: trace.setProblemDimensions(sub)
+        problem = sub
+
+def iterativeAlgorithm4(problem, bestSeen = None, rowSplit = True,
+                        trace = None):
+    original = problem
+
+    while True:
+        # if it's empty, we're done 
+        if problem.numRow <= 0 or problem.numCol <= 0:
+            return None
+
+        subproblems = []
+
+        if rowSplit:
+            # the next subproblem will involve half the number of rows
+            mid = problem.numRow // 2
+
+            # information about the two subproblems
+            (subStartR1, subNumR1) = (0, mid)
+            (subStartR2, subNumR2) = (mid + 1, problem.numRow - (mid + 1))
+            (subStartC, subNumC) = (0, problem.numCol)
+
+            subproblems.append((subStartR1, subStartC, subNumR1, subNumC))
+            subproblems.append((subStartR2, subStartC, subNumR2, subNumC))
+
+            # the dividing line is the middle row
+            axis = peak.ROW
+        else:
+            # the next subproblem will involve half the number of columns
+            mid = problem.numCol // 2
+
+            # information about the two subproblems
+            (subStartR, subNumR) = (0, problem.numRow)
+            (subStartC1, subNumC1) = (0, mid)
+            (subStartC2, subNumC2) = (mid + 1, problem.numCol - (mid + 1))
+
+            subproblems.append((subStartR, subStartC1, subNumR, subNumC1))
+            subproblems.append((subStartR, subStartC2, subNumR, subNumC2))
+
+            # the dividing line is the middle column
+            axis = peak.COLUMN
+
+        # find the maximum in the dividing row or column
+        bestLoc = problem.getLineMaximum(axis, mid, trace)
+        neighbor = problem.getBetterNeighbor(bestLoc, trace)
+
+        # update the best we've seen so far based on this new maximum
+        if bestSeen is None or problem.get(neighbor) > problem.get(bestSeen):
+            bestSeen = neighbor
+            if not trace is None: trace.setBestSeen(bestSeen)
+
+        # return when we know we've found a peak
+        if neighbor == bestLoc and problem.get(bestLoc) >= problem.get(bestSeen):
+            if not trace is None: trace.foundPeak(bestLoc)
+            return original.getLocationInSelf(problem, bestLoc)
+
+        # continue in the subproblem containing the largest number we've seen
+        # so far, alternating between splitting on rows and splitting on
+        # columns
+        sub = problem.getSubproblemContaining(subproblems, bestSeen)
+        bestSeen = sub.getLocationInSelf(problem, bestSeen)
+        if not trace is None: trace.setProblemDimensions(sub)
+        problem = sub
+        rowSplit = not rowSplit
+
+
+################################################################################
+################################# Peak Queries #################################
+################################################################################
+
+def buildMaximumTree(problem, leafSize = 4096):
+    """
+    Precomputes the maximum of every tile of the problem, as a tree built by
+    halving the problem like algorithm1 and algorithm4 do, always along its
+    longer side, until each tile has at most leafSize cells.  Each node is a
+    triple (maximum, bounds, children), where the bounds are relative to the
+    problem and a leaf has no children.  The tree can be reused by any
+    number of queries, as long as the matrix does not change.
+
+    RUNTIME: O(problem.numRow * problem.numCol)
+    """
+
+    def build(bounds):
+        (sRow, sCol, nRow, nCol) = bounds
+
+        if nRow * nCol <= leafSize or (nRow <= 1 and nCol <= 1):
+            best = None
+            positions = range(sCol, sCol + nCol)
+            for r in range(sRow, sRow + nRow):
+                values = problem.getLineValues(peak.ROW, r, positions)
+                if not values is None and (best is None or max(values) > best):
+                    best = max(values)
+            return (best, bounds, [])
+
+        if nRow >= nCol:
+            mid = nRow // 2
+            halves = [(sRow, sCol, mid, nCol),
+                      (sRow + mid, sCol, nRow - mid, nCol)]
+        else:
+            mid = nCol // 2
+            halves = [(sRow, sCol, nRow, mid),
+                      (sRow, sCol + mid, nRow, nCol - mid)]
+
+        children = [build(half) for half in halves]
+        return (max(child[0] for child in children), bounds, children)
+
+    return build((0, 0, problem.numRow, problem.numCol))
+
+def topPeaks(problem, k, tree = None):
+    """
+    Returns the k highest peaks of the problem (or all of them, if there are
+    fewer than k), from highest to lowest.  A priority queue holds tiles of
+    the maximum tree, keyed by their maximum, and peaks that have been found,
+    keyed by their value.  Whenever a tile comes out on top, it is replaced
+    by its children, or for a leaf, by the peaks inside it.  No peak in a
+    tile can be higher than the tile's maximum, so a peak that comes out on
+    top is higher than everything still in the queue, and the tiles that
+    never come out on top are never scanned.
+
+    RUNTIME: O(problem.numRow * problem.numCol) to build the tree; each query
+    then only scans the leaves whose maximum is above the k-th peak
+    """
+
+    if tree is None:
+        tree = buildMaximumTree(problem)
+
+    # entries are (-value, kind, key, item): tiles (kind 0) come out before
+    # peaks (kind 1) with the same value, so that every peak of that value is
+    # in the queue before any of them is returned, and ties between peaks
+    # are broken in row-major order
+    queue = []
+    if problem.numRow > 0 and problem.numCol > 0:
+        queue.append((-tree[0], 0, 0, tree))
+    count = 1
+
+    peaks = []
+    while len(queue) > 0 and len(peaks) < k:
+        (negative, kind, key, item) = heapq.heappop(queue)
+
+        if kind == 1:
+            peaks.append(item)
+            continue
+
+        (maximum, bounds, children) = item
+        if len(children) > 0:
+            for child in children:
+                heapq.heappush(queue, (-child[0], 0, count, child))
+                count += 1
+        else:
+            for location in problem.getRegionPeaks(bounds):
+                heapq.heappush(queue,
+                               (-problem.get(location), 1, location, location))
+
+    return peaks
+
+def peakInRegion(problem, bounds, trace = None):
+    """
+    Returns a peak of the region of the problem with the given bounds (a
+    quadruple like those given to getSubproblem), as a location in the
+    problem.  As for any subproblem, only neighbors inside the region are
+    considered.  The region is searched with iterativeAlgorithm4, whose
+    every step takes the maximum of one row or column segment, so if the
+    problem has a RangeMaximumIndex (see PeakProblem.buildIndex) each step
+    reads at most two blocks of the index.
+
+    RUNTIME: O(log(numRow * numCol) * blockSize) with an index,
+    O(numRow + numCol) otherwise, where numRow and numCol are the
+    dimensions of the region
+    """
+
+    region = problem.getSubproblem(bounds)
+    location = iterativeAlgorithm4(region, trace = trace)
+    if location is None:
+        return None
+    return problem.getLocationInSelf(region, location)
+
 ################################################################################
 ################################ Helper Methods ################################
 ################################################################################
@@ -180,13 +452,10 @@ def crossProduct(list1, list2):
     Returns all pairs with one item from the first list and one item from 
     the second list.  (Cartesian product of the two lists.)
 
-    The code is equivalent to the following list comprehension:
-        return [(a, b) for a in list1 for b in list2]
-    but for easier reading and analysis, we have included more explicit code.
+    The pairs are described lazily, and iterating over the result is
+    equivalent to iterating over the following list comprehension:
+        [(a, b) for a in list1 for b in list2]
+    but no pairs are generated until they are needed.
     """
 
-    answer = []
-    for a in list1:
-        for b in list2:
-            answer.append ((a, b))
-    return answer
+    return peak.CoordinateProduct(list1, list2)
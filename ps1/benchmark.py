@@ -0,0 +1,233 @@
+import sys
+import csv
+import math
+import array
+import timeit
+import argparse
+import tracemalloc
+import peak
+import generate
+import main
+
+################################################################################
+############################### Benchmark Methods ##############################
+################################################################################
+
+# the columns of the CSV file written by the benchmark
+FIELDS = ["shape", "algorithm", "rows", "cols", "seconds", "lookups",
+          "peakMemory", "isPeak"]
+
+def buildProblem(size, shape, seed = None):
+    """
+    Generates a size x size problem of the given shape (see generate.py) in
+    memory, in compact row-major storage.
+
+    RUNTIME: O(size * size)
+    """
+
+    typecode = generate.getTypecode(size, size, shape, size * size * 2)
+    values = array.array(typecode)
+    for chunk in generate.generateRows(size, size, shape, size * size * 2,
+                                       seed):
+        values.extend(chunk)
+    return peak.PeakProblem.from_buffer(values, size, size)
+
+def measure(problem, function, repeat = 1):
+    """
+    Runs an algorithm on a problem and returns the quadruple (location,
+    seconds, lookups, peak memory).  The time is the best of the given
+    number of plain runs; the lookups are counted in a separate run on a
+    CountingPeakProblem, and the peak memory (the most memory allocated
+    during the algorithm, in bytes) is measured in a third run under
+    tracemalloc, so that neither kind of bookkeeping affects the time.
+    """
+
+    seconds = None
+    for i in range(repeat):
+        start = timeit.default_timer()
+        location = function(problem)
+        elapsed = timeit.default_timer() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+
+    counting = peak.createCountingProblem(problem)
+    function(counting)
+
+    tracemalloc.start()
+    try:
+        function(problem)
+        (current, peakMemory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (location, seconds, counting.counter.lookups, peakMemory)
+
+def runBenchmark(sizes, shapes, selected, repeat = 1, seed = 0,
+                 report = None):
+    """
+    Runs every selected algorithm on a problem of every given size and shape.
+    Returns a list of result dictionaries, with the keys listed in FIELDS.
+    If a report function is given, it is called with each result as soon as
+    it is measured.
+    """
+
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            problem = buildProblem(size, shape, seed)
+            for (name, function) in selected:
+                (location, seconds, lookups, peakMemory) = measure(
+                    problem, function, repeat)
+                result = {
+                    "shape" : shape,
+                    "algorithm" : name,
+                    "rows" : size,
+                    "cols" : size,
+                    "seconds" : seconds,
+                    "lookups" : lookups,
+                    "peakMemory" : peakMemory,
+                    "isPeak" : location is not None and
+                               problem.isPeak(location)
+                }
+                results.append(result)
+                if not report is None:
+                    report(result)
+    return results
+
+def fitExponent(sizes, values):
+    """
+    Fits values ~ c * size^k by least squares on a log-log scale, and returns
+    the exponent k, or None if there are fewer than two usable points.  An
+    algorithm whose running time grows like n has an exponent near 1, one
+    that grows like n log n has an exponent somewhat above 1, and one that
+    grows like n^2 has an exponent near 2.
+    """
+
+    points = [(math.log(size), math.log(value))
+              for (size, value) in zip(sizes, values) if value > 0]
+    if len(points) < 2:
+        return None
+
+    meanX = sum(x for (x, y) in points) / len(points)
+    meanY = sum(y for (x, y) in points) / len(points)
+    covariance = sum((x - meanX) * (y - meanY) for (x, y) in points)
+    variance = sum((x - meanX) ** 2 for (x, y) in points)
+    if variance == 0:
+        return None
+    return covariance / variance
+
+def fitGrowth(results):
+    """
+    Fits growth exponents for the time and the lookups of every algorithm on
+    every shape.  Returns a list of (shape, algorithm, time exponent, lookup
+    exponent) quadruples.
+    """
+
+    groups = []
+    for result in results:
+        key = (result["shape"], result["algorithm"])
+        if not key in groups:
+            groups.append(key)
+
+    fits = []
+    for (shape, name) in groups:
+        group = [result for result in results
+                 if result["shape"] == shape and result["algorithm"] == name]
+        sizes = [result["rows"] for result in group]
+        fits.append((shape, name,
+                     fitExponent(sizes, [r["seconds"] for r in group]),
+                     fitExponent(sizes, [r["lookups"] for r in group])))
+    return fits
+
+def formatExponent(exponent):
+    """
+    Formats a fitted exponent for printing.
+    """
+
+    if exponent is None:
+        return "-"
+    return "%.2f" % exponent
+
+################################################################################
+################################ The Main Method ###############################
+################################################################################
+
+def parseArguments(arguments):
+    """
+    Parses the command-line arguments given to benchmark.py.
+    """
+
+    parser = argparse.ArgumentParser(
+        description = "Times the peak-finding algorithms on generated "
+                      "problems of increasing size, and fits how their "
+                      "running time and lookups grow.")
+    parser.add_argument("--min", type = int, default = 6,
+                        help = "the smallest problem is 2^MIN on a side "
+                               "(default: 6)")
+    parser.add_argument("--max", type = int, default = 11,
+                        help = "the largest problem is 2^MAX on a side "
+                               "(default: 11)")
+    parser.add_argument("--shapes", default = ",".join(generate.SHAPES),
+                        help = "a comma-separated list of the shapes to "
+                               "generate (default: all)")
+    parser.add_argument("--algorithms", metavar = "LIST",
+                        help = "a comma-separated list of the algorithm "
+                               "numbers to run (default: all)")
+    parser.add_argument("--repeat", type = int, default = 1,
+                        help = "time each run this many times, keeping the "
+                               "best (default: 1)")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "the seed for the random problems (default: 0)")
+    parser.add_argument("--output", metavar = "FILE",
+                        help = "the CSV file to write the measurements to "
+                               "(default: standard output)")
+    return parser.parse_args(arguments)
+
+def benchmark():
+    options = parseArguments(sys.argv[1:])
+
+    sizes = [2 ** exponent for exponent in range(options.min, options.max + 1)]
+    shapes = options.shapes.split(",")
+    for shape in shapes:
+        if not shape in generate.SHAPES:
+            raise ValueError("Unknown shape %r" % shape)
+
+    # the iterative algorithms give the same results, but algorithm 2 can
+    # take far more steps on large problems than the recursion limit allows
+    selected = main.iterativeAlgorithmList
+    if options.algorithms is not None:
+        selected = main.selectAlgorithms(selected, options.algorithms)
+
+    output = sys.stdout
+    if options.output is not None:
+        output = open(options.output, "w")
+
+    try:
+        writer = csv.DictWriter(output, FIELDS)
+        writer.writeheader()
+
+        def report(result):
+            writer.writerow(result)
+            output.flush()
+
+        results = runBenchmark(sizes, shapes, selected, options.repeat,
+                               options.seed, report)
+    finally:
+        if not options.output is None:
+            output.close()
+
+    # the fitted exponents go to standard error when the CSV file is being
+    # written to standard output
+    summary = sys.stdout
+    if options.output is None:
+        summary = sys.stderr
+
+    summary.write("\n%-8s %-12s %14s %16s\n" %
+                  ("shape", "algorithm", "time exponent", "lookup exponent"))
+    for (shape, name, timeExponent, lookupExponent) in fitGrowth(results):
+        summary.write("%-8s %-12s %14s %16s\n" %
+                      (shape, name, formatExponent(timeExponent),
+                       formatExponent(lookupExponent)))
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,9 +1,15 @@
 import os
 import sys
+import array
 import random
 import pprint
+import argparse
+import problemfile
 import utils
 
+# the shapes of matrix that generateRows() can produce
+SHAPES = ("random", "ramp", "spiral")
+
 def randomProblem(rows = 10, columns = 10, max = 1000):
     """
     Generate a random matrix, with the specified number of rows and
@@ -23,30 +29,220 @@ def randomProblem(rows = 10, columns = 10, max = 1000):
 
     return result
 
+def uniformValues(generator, count, maximum):
+    """
+    Returns a list of count numbers, each distributed uniformly at random
+    between zero and the specified maximum, drawn from the given
+    random.Random instance.  The random bits are generated in bulk, which is
+    much faster than calling randint() once per number.
+
+    RUNTIME: O(count)
+    """
+
+    words = array.array("Q")
+    words.frombytes(generator.randbytes(8 * count))
+    modulus = maximum + 1
+    return [word % modulus for word in words]
+
+def rampRow(row, columns):
+    """
+    Returns one row of a monotone ramp, in which the value of each cell is
+    the sum of its coordinates.  The only peak is the bottom-right corner, as
+    far as possible from where algorithm 2 starts.
+
+    RUNTIME: O(columns)
+    """
+
+    return list(range(row, row + columns))
+
+def spiralRow(row, rows, columns):
+    """
+    Returns one row of a spiral matrix.  The nonzero cells form a single path
+    that winds inwards from the top-left corner, separated from itself by
+    walls of zeros, and numbered 1, 2, 3, ... along the way.  The end of the
+    path is the only peak, and algorithm 2 has to follow the whole path
+    (about half of the cells) to reach it.
+
+    The path goes clockwise around every other ring of the matrix.  Each
+    ring stops just below its top-left corner, and a single bridge cell
+    leads from there to the top-left corner of the next ring inside it.
+    Rings that are too thin to go all the way around are just their top row
+    and right column.
+
+    RUNTIME: O(columns + min(rows, columns))
+    """
+
+    values = [0] * columns
+    (k, offset) = (0, 0)
+
+    while True:
+        (top, left, bottom, right) = (k, k, rows - 1 - k, columns - 1 - k)
+        (height, width) = (bottom - top + 1, right - left + 1)
+        if height < 1 or width < 1:
+            break
+
+        full = height >= 3 and width >= 3
+        if full:
+            length = 2 * width + 2 * height - 5
+        else:
+            length = width + height - 1
+
+        # the top row, then the right column, the bottom row (right to left)
+        # and the left column (bottom to top)
+        if top <= row and row <= bottom:
+            if row == top:
+                values[left:right + 1] = range(offset + 1, offset + width + 1)
+            elif full and row == bottom:
+                start = offset + (width - 1) + (height - 1)
+                values[left:right] = range(start + width, start + 1, -1)
+                values[right] = start + 1
+            else:
+                values[right] = offset + (width - 1) + (row - top) + 1
+                if full and row >= top + 2:
+                    values[left] = (offset + 2 * (width - 1) + (height - 1) +
+                                    (bottom - row) + 1)
+
+        # stop unless there is another ring inside this one
+        if not (full and height >= 5 and width >= 5):
+            break
+
+        # the bridge to the next ring
+        if row == top + 2:
+            values[left + 1] = offset + length + 1
+
+        offset += length + 1
+        k += 2
+
+    return values
+
+def getTypecode(rows, columns, shape = "random", maximum = 1000):
+    """
+    Returns the smallest array typecode that can hold every value of a
+    generated matrix with the given dimensions and shape.
+    """
+
+    if shape == "random":
+        largest = maximum
+    elif shape == "ramp":
+        largest = max(rows + columns - 2, 0)
+    else:
+        largest = rows * columns
+
+    return problemfile.chooseTypecode(0, largest)
+
+def generateRows(rows, columns, shape = "random", maximum = 1000, seed = None,
+                 chunkRows = None):
+    """
+    Generates a matrix of the given shape ("random", "ramp" or "spiral"),
+    yielding it in chunks of chunkRows rows at a time.  Each chunk is a flat
+    list of values in row-major order, so that a matrix far larger than
+    memory can be written out chunk by chunk.  Random matrices are generated
+    from the given seed, so the same seed always gives the same matrix.
+
+    RUNTIME: O(rows * columns)
+    """
+
+    if not shape in SHAPES:
+        raise ValueError("Unknown shape %r" % shape)
+    if chunkRows is None:
+        chunkRows = max(1, (1 << 20) // max(columns, 1))
+
+    generator = random.Random(seed)
+
+    for start in range(0, rows, chunkRows):
+        count = min(chunkRows, rows - start)
+
+        if shape == "random":
+            yield uniformValues(generator, count * columns, maximum)
+            continue
+
+        chunk = []
+        for row in range(start, start + count):
+            if shape == "ramp":
+                chunk.extend(rampRow(row, columns))
+            else:
+                chunk.extend(spiralRow(row, rows, columns))
+        yield chunk
+
+def generateMatrix(rows, columns, shape = "random", maximum = 1000,
+                   seed = None):
+    """
+    Generates a matrix of the given shape as a list of rows.
+
+    RUNTIME: O(rows * columns)
+    """
+
+    result = []
+    for chunk in generateRows(rows, columns, shape, maximum, seed):
+        for start in range(0, len(chunk), columns):
+            result.append(chunk[start:start + columns])
+    return result
+
+def writeBinaryProblem(filename, rows, columns, shape = "random",
+                       maximum = 1000, seed = None):
+    """
+    Generates a matrix of the given shape straight into a binary problem
+    file, one chunk at a time, using the smallest typecode that fits.
+
+    RUNTIME: O(rows * columns)
+    """
+
+    typecode = getTypecode(rows, columns, shape, maximum)
+    chunks = generateRows(rows, columns, shape, maximum, seed)
+    problemfile.writeProblem(filename, rows, columns, typecode, chunks)
+
+def parseArguments(arguments):
+    """
+    Parses the command-line arguments given to generate.py.
+    """
+
+    parser = argparse.ArgumentParser(
+        description = "Generates a matrix to run the peak-finding "
+                      "algorithms on.")
+    parser.add_argument("filename", nargs = "?",
+                        help = "the file to save the matrix to (prompted "
+                               "for if not given); names ending in .bin are "
+                               "written in the binary problem format")
+    parser.add_argument("rows", nargs = "?", type = int)
+    parser.add_argument("columns", nargs = "?", type = int)
+    parser.add_argument("maximum", nargs = "?", type = int,
+                        help = "the largest random number (default: twice "
+                               "the number of cells)")
+    parser.add_argument("--shape", choices = SHAPES, default = "random",
+                        help = "random numbers, a monotone ramp, or a "
+                               "spiral with a single peak (default: random)")
+    parser.add_argument("--seed", type = int,
+                        help = "the seed for the random number generator")
+    return parser.parse_args(arguments)
+
 def main():
-    filename = None
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
+    options = parseArguments(sys.argv[1:])
+    filename = options.filename
 
     (rows, cols) = (10, 10)
-    if len(sys.argv) > 3:
-        (rows, cols) = (int(sys.argv[2]), int(sys.argv[3]))
+    if options.columns is not None:
+        (rows, cols) = (options.rows, options.columns)
 
     maximum = rows * cols * 2
-    if len(sys.argv) > 4:
-        maximum = int(sys.argv[4])
-    
-    generated = randomProblem(rows, cols, maximum)
+    if options.maximum is not None:
+        maximum = options.maximum
 
-    print("Generated a matrix with %d row and %d columns." % (rows, cols))
     if filename is None:
         filename = utils.getSaveFilename("problem.py")
         if filename is None:
             return
 
-    with open(filename, "w") as outputFile:
-        outputFile.write("problemMatrix = ")
-        pprint.pprint(generated, outputFile)
+    if filename.endswith(".bin"):
+        writeBinaryProblem(filename, rows, cols, options.shape, maximum,
+                           options.seed)
+    else:
+        generated = generateMatrix(rows, cols, options.shape, maximum,
+                                   options.seed)
+        with open(filename, "w") as outputFile:
+            outputFile.write("problemMatrix = ")
+            pprint.pprint(generated, outputFile)
+
+    print("Generated a matrix with %d row and %d columns." % (rows, cols))
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,13 @@
+import os
 import sys
+import argparse
+import multiprocessing
+import timeit
 import peak
 import trace
 import algorithms
 import json
+import problemfile
 import utils
 
 ################################################################################
@@ -12,49 +17,247 @@ import utils
 def loadProblem(file = "problem.py", variable = "problemMatrix"):
     """
     Loads a matrix from a python file, and constructs a PeakProblem from it.
+    Binary problem files (see problemfile.py) are recognized by their first
+    bytes, and are memory-mapped instead of being executed.
     """
 
+    if problemfile.isBinaryProblem(file):
+        return problemfile.loadProblem(file)
+
     namespace = dict()
     with open(file) as handle:
         exec(handle.read(), namespace)
     return peak.createProblem(namespace[variable])
 
+# the algorithms to run, with the names used when printing their results
+algorithmList = [("Algorithm 1", algorithms.algorithm1),
+                 ("Algorithm 2", algorithms.algorithm2),
+                 ("Algorithm 3", algorithms.algorithm3),
+                 ("Algorithm 4", algorithms.algorithm4)]
+
+# the same algorithms, implemented with loops instead of recursion
+iterativeAlgorithmList = [("Algorithm 1", algorithms.iterativeAlgorithm1),
+                          ("Algorithm 2", algorithms.iterativeAlgorithm2),
+                          ("Algorithm 3", algorithms.iterativeAlgorithm3),
+                          ("Algorithm 4", algorithms.iterativeAlgorithm4)]
+
+def parseArguments(arguments):
+    """
+    Parses the command-line arguments given to main.py.
+    """
+
+    parser = argparse.ArgumentParser(
+        description = "Runs the peak-finding algorithms on a problem, and "
+                      "writes their traces to trace.jsonp.")
+    parser.add_argument("filename", nargs = "?",
+                        help = "the file to read the matrix from (prompted "
+                               "for if not given)")
+    parser.add_argument("--iterative", action = "store_true",
+                        help = "run the non-recursive versions of the "
+                               "algorithms")
+    parser.add_argument("--no-trace", action = "store_true",
+                        help = "do not write trace.jsonp, which holds every "
+                               "cell of the matrix (use this for large "
+                               "binary problems)")
+    parser.add_argument("--count", action = "store_true",
+                        help = "count the matrix cells that each algorithm "
+                               "reads, in total and per kind of call")
+    parser.add_argument("--batch", metavar = "PATH",
+                        help = "run on every problem in a directory, or on "
+                               "every problem listed in a manifest file, "
+                               "printing one JSON result per line")
+    parser.add_argument("--algorithms", metavar = "LIST",
+                        help = "in batch mode, a comma-separated list of the "
+                               "algorithm numbers to run (default: all)")
+    parser.add_argument("--processes", type = int,
+                        help = "in batch mode, the number of worker processes "
+                               "(default: one per CPU)")
+    parser.add_argument("--output", metavar = "FILE",
+                        help = "in batch mode, the file to write results to "
+                               "(default: standard output)")
+    return parser.parse_args(arguments)
+
+def formatLookups(counter):
+    """
+    Describes the counts kept by a LookupCounter in one line of text.
+    """
+
+    summary = counter.getSummary()
+    calls = []
+    for name in sorted(summary):
+        calls.append("%s: %d calls, %d lookups" %
+                     (name, summary[name]["calls"], summary[name]["lookups"]))
+    return "%d lookups (%s)" % (counter.lookups, "; ".join(calls))
+
+def selectAlgorithms(selected, numbers):
+    """
+    Returns the entries of an algorithm list chosen by a comma-separated list
+    of algorithm numbers, such as "1,3".
+    """
+
+    chosen = []
+    for number in numbers.split(","):
+        index = int(number) - 1
+        if not (0 <= index and index < len(selected)):
+            raise ValueError("There is no algorithm %s" % number)
+        chosen.append(selected[index])
+    return chosen
+
 def main():
-    if len(sys.argv) > 1:
-        problem = loadProblem(sys.argv[1])
+    options = parseArguments(sys.argv[1:])
+
+    selected = algorithmList
+    if options.iterative:
+        selected = iterativeAlgorithmList
+
+    if options.batch is not None:
+        if options.algorithms is not None:
+            selected = selectAlgorithms(selected, options.algorithms)
+        if options.output is None:
+            runBatch(options.batch, selected, options.processes, sys.stdout)
+        else:
+            with open(options.output, "w") as output:
+                runBatch(options.batch, selected, options.processes, output)
+        return
+
+    if options.filename is not None:
+        problem = loadProblem(options.filename)
     else:
         problem = loadProblem(utils.getOpenFilename("problem.py"))
 
-    # run all algorithms, gathering the traces and printing out the results as
-    # we go
-    algorithmList = [("Algorithm 1", algorithms.algorithm1),
-                     ("Algorithm 2", algorithms.algorithm2),
-                     ("Algorithm 3", algorithms.algorithm3),
-                     ("Algorithm 4", algorithms.algorithm4)]
-
-    steps = []
-    
-    for (name, function) in algorithmList:
-        tracer = trace.TraceRecord()
-        peak = function(problem, trace = tracer)
-        steps.append(tracer.sequence)
-        
+    if options.no_trace:
+        runAlgorithms(problem, selected, options.count, None)
+        return
+
+    # run all algorithms, writing out the traces and printing out the results
+    # as we go
+    with open("trace.jsonp", "w") as traceFile:
+        writer = trace.TraceWriter(traceFile, problem)
+        runAlgorithms(problem, selected, options.count, writer)
+        writer.close()
+
+def runAlgorithms(problem, selected, count, writer):
+    """
+    Runs the selected algorithms on a problem, printing out their results.
+    If a TraceWriter is given, each algorithm's trace is written to it;
+    otherwise no trace is recorded, so that only the cells the algorithms
+    read are ever touched.
+    """
+
+    for (name, function) in selected:
+        tracer = None
+        if not writer is None:
+            tracer = writer.startAlgorithm()
+        solved = problem
+        if count:
+            solved = peak.createCountingProblem(problem)
+        location = function(solved, trace = tracer)
+        if not tracer is None:
+            tracer.close()
+
         status = "is NOT a peak (INCORRECT!)"
-        if problem.isPeak(peak):
+        if problem.isPeak(location):
             status = "is a peak"
 
-        print(name + " : " + str(peak) + " => " + status)
+        print(name + " : " + str(location) + " => " + status)
+        if count:
+            print("    " + formatLookups(solved.counter))
 
-    # write the trace out to a file
-    with open("trace.jsonp", "w") as traceFile:
-        traceFile.write("parse(")
+################################################################################
+################################## Batch Mode ##################################
+################################################################################
+
+def findBatchProblems(path):
+    """
+    Returns the problem files named by a batch path.  If the path is a
+    directory, these are the python problem files (ending in .py) and the
+    binary problem files in it, in sorted order; other files are skipped, so
+    that a stray script or text file is never executed.  Otherwise the path
+    is a manifest: a text file listing one problem file per line, relative
+    to the manifest's directory.  Blank lines and lines starting with # are
+    ignored.
+    """
+
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        files = [os.path.join(path, name) for name in names]
+        return [name for name in files if os.path.isfile(name) and
+                (name.endswith(".py") or problemfile.isBinaryProblem(name))]
+
+    files = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            files.append(os.path.join(os.path.dirname(path), line))
+    return files
+
+def solveBatchProblem(task):
+    """
+    Loads one problem file and runs the given algorithms on it, returning a
+    list with one result dictionary per algorithm.  Each algorithm is run
+    twice: once on the plain problem to measure the elapsed time, and once
+    on a CountingPeakProblem to count the cells it reads.  This is run in a
+    worker process by runBatch().
+    """
+
+    (filename, selected) = task
+
+    try:
+        problem = loadProblem(filename)
+    except Exception as error:
+        return [{"problem" : filename, "error" : str(error)}]
+
+    results = []
+    for (name, function) in selected:
+        try:
+            start = timeit.default_timer()
+            location = function(problem)
+            elapsed = timeit.default_timer() - start
+
+            counting = peak.createCountingProblem(problem)
+            function(counting)
+        except Exception as error:
+            results.append({"problem" : filename, "algorithm" : name,
+                            "error" : str(error)})
+            continue
 
-        json.dump({
-            "input" : problem.array,
-            "steps" : steps
-        }, traceFile)
+        results.append({
+            "problem" : filename,
+            "algorithm" : name,
+            "peak" : location,
+            "isPeak" : location is not None and problem.isPeak(location),
+            "elapsed" : elapsed,
+            "lookups" : counting.counter.lookups,
+            "lookupsByCall" : counting.counter.getSummary()
+        })
+    return results
 
-        traceFile.write(")")
+def runBatch(path, selected, processes, output):
+    """
+    Runs the selected algorithms on every problem named by the batch path,
+    spreading the problems over a pool of worker processes.  Results are
+    written to the output as JSON lines, in the order the problems finish.
+    If writing fails or the batch is interrupted, the workers are stopped
+    without finishing the remaining problems.
+    """
+
+    tasks = [(filename, selected) for filename in findBatchProblems(path)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for results in pool.imap_unordered(solveBatchProblem, tasks):
+            for result in results:
+                output.write(json.dumps(result) + "\n")
+            output.flush()
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
 
 if __name__ == "__main__":
     main()
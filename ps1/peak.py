@@ -1,5 +1,11 @@
+import array
+import multiprocessing
 import trace
 
+# Axes accepted by PeakProblem.getLineMaximum().
+ROW = "row"
+COLUMN = "column"
+
 ################################################################################
 ########################### Class for Peak Problems ############################
 ################################################################################
@@ -9,10 +15,12 @@ class PeakProblem(object):
     A class representing an instance of a peak-finding problem.
     """
 
-    def __init__(self, array, bounds):
+    def __init__(self, array, bounds, stride):
         """
         A method for initializing an instance of the PeakProblem class.
-        Takes an array and an argument indicating which rows to include.
+        Takes a flat array holding the matrix in row-major order, an argument
+        indicating which rows and columns to include, and the stride (the
+        number of columns in each row of the flat array).
 
         RUNTIME: O(1)
         """
@@ -21,10 +29,32 @@ class PeakProblem(object):
 
         self.array = array
         self.bounds = bounds
+        self.stride = stride
         self.startRow = startRow
         self.startCol = startCol
         self.numRow = numRow
         self.numCol = numCol
+        self.offset = startRow * stride + startCol
+        self.index = None
+        self.version = StorageVersion()
+
+    @classmethod
+    def from_buffer(cls, buffer, numRow, numCol):
+        """
+        Constructs a problem directly on top of a flat, row-major buffer of
+        numbers (such as an array.array, or a memoryview of a file).  The
+        buffer is not copied, so every subproblem is a view over the same
+        memory.
+
+        RUNTIME: O(1)
+        """
+
+        if numRow < 0 or numCol < 0:
+            raise ValueError("Invalid matrix dimensions")
+        if len(buffer) < numRow * numCol:
+            raise ValueError("Buffer is too small for the given dimensions")
+
+        return cls(buffer, (0, 0, numRow, numCol), numCol)
 
     def get(self, location):
         """
@@ -39,7 +69,7 @@ class PeakProblem(object):
             return 0
         if not (0 <= c and c < self.numCol):
             return 0
-        return self.array[self.startRow + r][self.startCol + c]
+        return self.array[self.offset + r * self.stride + c]
 
     def getBetterNeighbor(self, location, trace = None):
         """
@@ -68,20 +98,101 @@ class PeakProblem(object):
     def getMaximum(self, locations, trace = None):
         """
         Finds the location in the current problem with the greatest value.
+        The locations may be any iterable of (r, c) pairs; a lazy
+        CoordinateProduct along a single row or column (or a CoordinateChain
+        of them) is scanned without generating its locations.
+
+        RUNTIME: O(len(locations))
+        """
+
+        bestLoc = self.findMaximum(locations)
+    
+        if not trace is None: trace.getMaximum(locations, bestLoc)
+
+        return bestLoc
+
+    def findMaximum(self, locations):
+        """
+        Does the work of getMaximum(), without recording anything in a trace.
+        Ties are broken in favor of the location that comes first.
 
         RUNTIME: O(len(locations))
         """
+
+        if isinstance(locations, CoordinateChain):
+            bestLoc = None
+            for part in locations.parts:
+                loc = self.findMaximum(part)
+                if bestLoc is None or (not loc is None and
+                                       self.get(loc) > self.get(bestLoc)):
+                    bestLoc = loc
+            return bestLoc
+
+        if isinstance(locations, CoordinateProduct):
+            line = locations.getLine()
+            best = None
+            if not line is None:
+                (axis, index, positions) = line
+                best = self.findLinePosition(axis, index, positions)
+            if not best is None:
+                if axis == ROW:
+                    return (index, best)
+                return (best, index)
    
         (bestLoc, bestVal) = (None, 0)
     
         for loc in locations:
             if bestLoc is None or self.get(loc) > bestVal:
                 (bestLoc, bestVal) = (loc, self.get(loc))
-    
-        if not trace is None: trace.getMaximum(locations, bestLoc)
 
         return bestLoc
 
+    def findLinePosition(self, axis, index, positions):
+        """
+        Returns the position of the greatest value at the given positions (a
+        range) along one row or column, or None if they cannot be read as a
+        slice (see getLineValues).  If the problem has a RangeMaximumIndex
+        (see buildIndex) and the positions are contiguous, the index answers
+        without reading the line.
+
+        RUNTIME: O(blockSize) with an index, O(len(positions)) otherwise
+        """
+
+        if not self.index is None and positions.step == 1:
+            best = self.index.findLineMaximum(self, axis, index, positions)
+            if not best is None:
+                return best
+
+        values = self.getLineValues(axis, index, positions)
+        if values is None:
+            return None
+        return positions[findMaximumIndex(values)]
+
+    def getLineMaximum(self, axis, index, trace = None):
+        """
+        Finds the location with the greatest value in one row (axis ROW) or
+        one column (axis COLUMN) of the current problem.  Gives the same
+        answer as calling getMaximum() on every location in that line, but
+        scans the line with a single reduction over a slice of the storage.
+
+        RUNTIME: O(numCol) for a row, O(numRow) for a column
+        """
+
+        return self.getMaximum(self.getLineLocations(axis, index), trace)
+
+    def getCrossMaximum(self, row, col, trace = None):
+        """
+        Finds the location with the greatest value on the cross formed by the
+        given row and column.  Ties are broken in favor of the row, matching
+        getMaximum() on the row locations followed by the column locations.
+
+        RUNTIME: O(numRow + numCol)
+        """
+
+        cross = CoordinateChain([self.getLineLocations(ROW, row),
+                                 self.getLineLocations(COLUMN, col)])
+        return self.getMaximum(cross, trace)
+
     def isPeak(self, location):
         """
         Returns true if the given location is a peak in the current subproblem.
@@ -91,17 +202,116 @@ class PeakProblem(object):
 
         return (self.getBetterNeighbor(location) == location)
 
+    def set(self, location, value):
+        """
+        Changes the value of the array at the given location, offset by the
+        coordinates (startRow, startCol).  The storage is shared, so the
+        change is seen by every problem viewing the same array.  The change
+        is recorded in the StorageVersion shared by those problems, which
+        makes any RangeMaximumIndex built over them out of date.  Raises an
+        IndexError for a location outside the current problem, and a
+        ValueError if the storage is read-only (such as a memory-mapped
+        binary problem file).
+
+        RUNTIME: O(1)
+        """
+
+        (r, c) = location
+        if not (0 <= r and r < self.numRow and 0 <= c and c < self.numCol):
+            raise IndexError("Location %r is outside the problem" %
+                             (location,))
+        if isinstance(self.array, memoryview) and self.array.readonly:
+            raise ValueError("Problem storage is read-only")
+        self.array[self.offset + r * self.stride + c] = value
+        self.version.bump()
+
+    def update(self, edits, peak = None, trace = None):
+        """
+        Applies a list of (r, c, value) edits to the current problem, and
+        repairs a peak found before the edits.  If the old peak still has no
+        better neighbor, it is returned as is.  Otherwise a peak is found by
+        climbing, as in algorithm2, from the highest of the old peak and the
+        edited cells: every step of the climb moves to a strictly higher
+        cell, so the climb only runs as far as the edits disturbed the
+        matrix around it.  If no peak is given, the climb starts from the
+        highest edited cell.  The locations of the edits and of the peak, and
+        whether the values fit the storage, are all checked before any edit
+        is applied, so a bad edit raises an IndexError, a TypeError, an
+        OverflowError or a ValueError (as set() does) without changing the
+        problem.
+
+        Returns the repaired peak, or None if the problem is empty.
+
+        RUNTIME: O(len(edits) + length of the climb)
+        """
+
+        if self.numRow <= 0 or self.numCol <= 0:
+            return None
+
+        edits = list(edits)
+        locations = [(r, c) for (r, c, value) in edits]
+        if not peak is None:
+            locations.append(peak)
+        for (r, c) in locations:
+            if not (0 <= r and r < self.numRow and 0 <= c and c < self.numCol):
+                raise IndexError("Location %r is outside the problem" %
+                                 ((r, c),))
+
+        # converting the values to the storage's typecode raises the same
+        # errors as storing them would
+        typecode = None
+        if isinstance(self.array, array.array):
+            typecode = self.array.typecode
+        elif isinstance(self.array, memoryview):
+            if self.array.readonly:
+                raise ValueError("Problem storage is read-only")
+            typecode = self.array.format
+        if not typecode is None and len(typecode) == 1:
+            array.array(typecode, [value for (r, c, value) in edits])
+
+        for (r, c, value) in edits:
+            self.set((r, c), value)
+
+        if not peak is None and self.isPeak(peak):
+            if not trace is None: trace.foundPeak(peak)
+            return peak
+
+        starts = [(r, c) for (r, c, value) in edits]
+        if not peak is None:
+            starts.append(peak)
+        location = (0, 0)
+        if len(starts) > 0:
+            location = max(starts, key = self.get)
+
+        while True:
+            better = self.getBetterNeighbor(location, trace)
+            if better == location:
+                break
+            location = better
+
+        if not trace is None: trace.foundPeak(location)
+        return location
+
     def getSubproblem(self, bounds):
         """
         Returns a subproblem with the given bounds.  The bounds is a quadruple
-        of numbers: (starting row, starting column, # of rows, # of columns).
+        of numbers: (starting row, starting column, # of rows, # of columns),
+        which must lie inside the current problem.
 
         RUNTIME: O(1)
         """
 
         (sRow, sCol, nRow, nCol) = bounds
+        if not (0 <= sRow and 0 <= nRow and sRow + nRow <= self.numRow):
+            raise ValueError("Subproblem rows are outside the problem")
+        if not (0 <= sCol and 0 <= nCol and sCol + nCol <= self.numCol):
+            raise ValueError("Subproblem columns are outside the problem")
+
         newBounds = (self.startRow + sRow, self.startCol + sCol, nRow, nCol)
-        return PeakProblem(self.array, newBounds)
+        sub = self.__class__(self.array, newBounds, self.stride)
+        sub.index = self.index
+        sub.version = self.version
+        return sub
 
     def getSubproblemContaining(self, boundList, location):
         """
@@ -134,6 +344,657 @@ class PeakProblem(object):
         newCol = col + problem.startCol - self.startCol
         return (newRow, newCol)
 
+    def getRow(self, r):
+        """
+        Returns the values in row r of the current problem, as a slice of the
+        underlying storage.
+
+        RUNTIME: O(numCol)
+        """
+
+        start = self.offset + r * self.stride
+        return self.array[start:start + self.numCol]
+
+    def getColumn(self, c):
+        """
+        Returns the values in column c of the current problem, as a strided
+        slice of the underlying storage.
+
+        RUNTIME: O(numRow)
+        """
+
+        start = self.offset + c
+        return self.array[start:start + self.numRow * self.stride:self.stride]
+
+    def getLineValues(self, axis, index, positions):
+        """
+        Returns the values at the given evenly spaced positions (a range) along
+        one row or column of the current problem, as a single slice of the
+        underlying storage.  Returns None if the positions are not in
+        increasing order, or if any of them lies outside the current problem.
+
+        RUNTIME: O(len(positions))
+        """
+
+        cells = self.getLineSlice(axis, index, positions)
+        if cells is None:
+            return None
+        return self.array[cells]
+
+    def getLineSlice(self, axis, index, positions):
+        """
+        Returns the slice of the underlying storage holding the values that
+        getLineValues() returns, or None if it would return None.
+
+        RUNTIME: O(1)
+        """
+
+        if len(positions) == 0 or positions.step <= 0:
+            return None
+
+        if axis == ROW:
+            (numLines, numPositions) = (self.numRow, self.numCol)
+            (base, step) = (self.offset + index * self.stride, 1)
+        else:
+            (numLines, numPositions) = (self.numCol, self.numRow)
+            (base, step) = (self.offset + index, self.stride)
+
+        (first, last) = (positions[0], positions[-1])
+        if not (0 <= index and index < numLines):
+            return None
+        if not (0 <= first and last < numPositions):
+            return None
+
+        return slice(base + first * step, base + last * step + 1,
+                     step * positions.step)
+
+    def getLineLocations(self, axis, index):
+        """
+        Returns a lazy description of all locations in one row or column of
+        the current problem, in the order they are scanned by
+        getLineMaximum().
+
+        RUNTIME: O(1)
+        """
+
+        if axis == ROW:
+            return CoordinateProduct([index], range(self.numCol))
+        elif axis == COLUMN:
+            return CoordinateProduct(range(self.numRow), [index])
+        raise ValueError("Invalid axis")
+
+    def getTile(self, startRow, numRows, startCol = 0, numCols = None):
+        """
+        Returns a tile of the current problem for findTilePeaks(): the
+        quintuple (startRow, startCol, above, rows, below), where rows is the
+        list of numRows rows starting at startRow, each cut down to numCols
+        columns starting at startCol (all columns, by default), and above and
+        below are the halo rows just outside the tile (None at the edges of
+        the problem).  The rows are copied into arrays or lists, so that the
+        tile can be sent to another process.
+
+        RUNTIME: O((numRows + 2) * numCols)
+        """
+
+        if numCols is None:
+            numCols = self.numCol - startCol
+        positions = range(startCol, startCol + numCols)
+
+        def copyRow(r):
+            values = self.getLineValues(ROW, r, positions)
+            if values is None:
+                return []
+            if not isinstance(values, (array.array, list)):
+                values = values.tolist()
+            return values
+
+        rows = [copyRow(r) for r in range(startRow, startRow + numRows)]
+        (above, below) = (None, None)
+        if startRow > 0:
+            above = copyRow(startRow - 1)
+        if startRow + numRows < self.numRow:
+            below = copyRow(startRow + numRows)
+        return (startRow, startCol, above, rows, below)
+
+    def getRegionPeaks(self, bounds):
+        """
+        Returns the list of peaks of the current problem that lie inside the
+        given bounds (start row, start column, # of rows, # of columns), in
+        row-major order.  Neighbors just outside the bounds are taken into
+        account, so these are peaks of the whole problem, not of the region.
+
+        RUNTIME: O(# of rows * # of columns)
+        """
+
+        (sRow, sCol, nRow, nCol) = bounds
+        if nRow <= 0 or nCol <= 0:
+            return []
+
+        # widen the tile by a column on each side, as a halo
+        first = max(sCol - 1, 0)
+        last = min(sCol + nCol + 1, self.numCol)
+        tile = self.getTile(sRow, nRow, first, last - first)
+        return [(r, c) for (r, c) in findTilePeaks(tile)
+                if sCol <= c and c < sCol + nCol]
+
+    def allPeaks(self, tileRows = None, processes = None):
+        """
+        Generates every peak of the current problem (every location without a
+        better neighbor, as defined by isPeak), in row-major order.  The
+        matrix is scanned one tile of tileRows rows at a time, each with a
+        halo of one row above and below, so that only a few rows are copied
+        out of the storage at once.  If processes is greater than one, the
+        tiles are scanned by a pool of that many worker processes.
+
+        RUNTIME: O(numRow * numCol)
+        """
+
+        if tileRows is None:
+            tileRows = max(1, (1 << 16) // max(self.numCol, 1))
+        starts = range(0, self.numRow, tileRows)
+        tiles = (self.getTile(start, min(tileRows, self.numRow - start))
+                 for start in starts)
+
+        if processes is None or processes <= 1:
+            for tile in tiles:
+                for location in findTilePeaks(tile):
+                    yield location
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for peaks in pool.imap(findTilePeaks, tiles):
+                for location in peaks:
+                    yield location
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def buildIndex(self, blockSize = 256):
+        """
+        Precomputes a RangeMaximumIndex over the current problem, so that the
+        maximum of any contiguous segment of a row or column can be found by
+        reading at most 2 * blockSize cells.  The index is shared with every
+        subproblem taken from this problem afterwards.  Changing a cell
+        through set() or update(), on this problem or on any view of its
+        storage, makes the index out of date; call buildIndex() again to
+        rebuild it.
+
+        RUNTIME: O(numRow * numCol)
+        """
+
+        self.index = RangeMaximumIndex(self, blockSize)
+        return self.index
+
+    def getMatrix(self):
+        """
+        Returns the values of the current problem as a list of rows, suitable
+        for printing or exporting to JSON.
+
+        RUNTIME: O(numRow * numCol)
+        """
+
+        rows = []
+        for r in range(self.numRow):
+            start = self.offset + r * self.stride
+            rows.append(list(self.array[start:start + self.numCol]))
+        return rows
+
+################################################################################
+########################## Class for Counting Lookups ##########################
+################################################################################
+
+class LookupCounter(object):
+    """
+    A running count of the number of matrix cells read, shared by a problem
+    and all of its subproblems.  Besides the total, it keeps the number of
+    calls to each of get(), getBetterNeighbor(), getMaximum(),
+    getLineValues() and getTile(), and the number of cells read by those
+    calls.  Reads made by a method on behalf of another (such as the get()
+    calls inside getBetterNeighbor()) are charged to the outermost call, and
+    a cell read more than once during the same outermost call (such as the
+    center of a cross) is only counted once.
+    """
+
+    def __init__(self):
+        """
+        Initialize the counts to zero.
+
+        RUNTIME: O(1)
+        """
+
+        self.reset()
+
+    def reset(self):
+        """
+        Sets all of the counts back to zero.
+
+        RUNTIME: O(1)
+        """
+
+        self.lookups = 0
+        self.calls = {}
+        self.reads = {}
+        self.current = None
+        self.seen = set()
+
+    def enter(self, name):
+        """
+        Records the start of a call to the named method.  Returns true if it
+        is the outermost counted call, in which case it must be matched by a
+        call to leave() with the same result.
+
+        RUNTIME: O(1)
+        """
+
+        if not self.current is None:
+            return False
+
+        self.current = name
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.reads[name] = self.reads.get(name, 0)
+        return True
+
+    def leave(self, outermost):
+        """
+        Records the end of a call started with enter().
+
+        RUNTIME: O(1)
+        """
+
+        if outermost:
+            self.current = None
+            self.seen = set()
+
+    def add(self, cells):
+        """
+        Counts the given cells (offsets into the problem's storage) as read by
+        the current call, except for those it has already read.
+
+        RUNTIME: O(len(cells))
+        """
+
+        before = len(self.seen)
+        self.seen.update(cells)
+        count = len(self.seen) - before
+        self.lookups += count
+        self.reads[self.current] += count
+
+    def getSummary(self):
+        """
+        Returns a dictionary mapping each method that was called to a
+        dictionary with its number of "calls" and of "lookups" (cells read).
+
+        RUNTIME: O(1)
+        """
+
+        summary = {}
+        for name in self.calls:
+            summary[name] = {"calls" : self.calls[name],
+                             "lookups" : self.reads[name]}
+        return summary
+
+class CountingPeakProblem(PeakProblem):
+    """
+    A PeakProblem that counts every matrix cell it reads.  It is only used
+    when lookups are being measured, so that PeakProblem itself pays nothing
+    for the bookkeeping.
+    """
+
+    def __init__(self, array, bounds, stride, counter = None):
+        """
+        Initializes the problem like a PeakProblem, counting lookups with the
+        given LookupCounter (or a new one).
+
+        RUNTIME: O(1)
+        """
+
+        PeakProblem.__init__(self, array, bounds, stride)
+        if counter is None:
+            counter = LookupCounter()
+        self.counter = counter
+
+    def get(self, location):
+        """
+        Returns the value at the given location, counting one lookup if the
+        location is inside the current problem.
+
+        RUNTIME: O(1)
+        """
+
+        outermost = self.counter.enter("get")
+        (r, c) = location
+        if 0 <= r and r < self.numRow and 0 <= c and c < self.numCol:
+            self.counter.add([self.offset + r * self.stride + c])
+        self.counter.leave(outermost)
+        return PeakProblem.get(self, location)
+
+    def getBetterNeighbor(self, location, trace = None):
+        """
+        Finds the best neighbor like PeakProblem.getBetterNeighbor(),
+        counting the cells it reads.
+
+        RUNTIME: O(1)
+        """
+
+        outermost = self.counter.enter("getBetterNeighbor")
+        try:
+            return PeakProblem.getBetterNeighbor(self, location, trace)
+        finally:
+            self.counter.leave(outermost)
+
+    def getMaximum(self, locations, trace = None):
+        """
+        Finds the maximum like PeakProblem.getMaximum(), counting the cells it
+        reads.  Row, column and cross maxima are counted here too, including
+        the cells read through a RangeMaximumIndex.
+
+        RUNTIME: O(len(locations))
+        """
+
+        outermost = self.counter.enter("getMaximum")
+        try:
+            return PeakProblem.getMaximum(self, locations, trace)
+        finally:
+            self.counter.leave(outermost)
+
+    def getLineValues(self, axis, index, positions):
+        """
+        Returns the values along a row or column, counting one lookup for
+        every value in the returned slice.
+
+        RUNTIME: O(len(positions))
+        """
+
+        cells = self.getLineSlice(axis, index, positions)
+        if cells is None:
+            return None
+        outermost = self.counter.enter("getLineValues")
+        self.counter.add(range(cells.start, cells.stop, cells.step))
+        self.counter.leave(outermost)
+        return self.array[cells]
+
+    def getTile(self, startRow, numRows, startCol = 0, numCols = None):
+        """
+        Copies a tile like PeakProblem.getTile(), counting the cells it reads.
+        Peak enumeration (getRegionPeaks and allPeaks) is counted here.
+
+        RUNTIME: O((numRows + 2) * numCols)
+        """
+
+        outermost = self.counter.enter("getTile")
+        try:
+            return PeakProblem.getTile(self, startRow, numRows, startCol,
+                                       numCols)
+        finally:
+            self.counter.leave(outermost)
+
+    def getSubproblem(self, bounds):
+        """
+        Returns a subproblem with the given bounds, sharing this problem's
+        counter.
+
+        RUNTIME: O(1)
+        """
+
+        sub = PeakProblem.getSubproblem(self, bounds)
+        sub.counter = self.counter
+        return sub
+
+################################################################################
+############################# Range Maximum Index ##############################
+################################################################################
+
+class StorageVersion(object):
+    """
+    A count of the changes made through PeakProblem.set() to the storage of
+    a problem.  It is shared by the problem and by every view of the same
+    storage taken from it (subproblems and counting problems), so that a
+    RangeMaximumIndex built over one view notices changes made through any
+    other.  Changes made to the storage directly, or through a problem built
+    separately over the same buffer, are not counted.
+    """
+
+    def __init__(self):
+        """
+        Starts the count at zero.
+
+        RUNTIME: O(1)
+        """
+
+        self.count = 0
+
+    def bump(self):
+        """
+        Counts one more change.
+
+        RUNTIME: O(1)
+        """
+
+        self.count += 1
+
+class RangeMaximumIndex(object):
+    """
+    Block sparse tables over every row and every column of a problem.  Each
+    line is cut into blocks of blockSize positions, and the index keeps the
+    position of the greatest value of every block, and a sparse table over
+    the blocks: for every power of two 2^k and every block i, the block with
+    the greatest maximum among blocks i to i + 2^k - 1.  The maximum of a
+    segment is found by scanning the partial blocks at its two ends, and
+    taking the whole blocks in between from the sparse table with two
+    lookups.  Ties are broken in favor of the first position, as in
+    PeakProblem.findMaximum().
+
+    Values are always read from the problem's storage, never copied, and
+    positions are stored in the narrowest array typecode that fits, so the
+    index takes O(numRow * numCol / blockSize * log(numRow * numCol))
+    small integers.
+
+    The index covers the bounds of the problem it was built from, and
+    answers for any subproblem of it that shares the same storage, until a
+    cell is changed through set().
+    """
+
+    def __init__(self, problem, blockSize = 256):
+        """
+        Builds the block sparse tables for every row and column of the
+        problem.  The cells are read in slices of blockSize cells, which are
+        not counted as lookups if the problem is a CountingPeakProblem.
+
+        RUNTIME: O(numRow * numCol)
+        """
+
+        if blockSize < 1:
+            raise ValueError("Invalid block size")
+
+        self.version = problem.version
+        self.count = problem.version.count
+        self.startRow = problem.startRow
+        self.startCol = problem.startCol
+        self.numRow = problem.numRow
+        self.numCol = problem.numCol
+        self.blockSize = blockSize
+
+        self.rowTables = [self.buildLineTable(problem, ROW, r, problem.numCol)
+                          for r in range(problem.numRow)]
+        self.colTables = [self.buildLineTable(problem, COLUMN, c,
+                                              problem.numRow)
+                          for c in range(problem.numCol)]
+
+    def buildLineTable(self, problem, axis, index, length):
+        """
+        Builds the table of one row or column of the given length, as the
+        pair (positions, levels), where positions[i] is the position of the
+        greatest value of block i, and levels is the block's sparse table
+        (see buildSparseTable).
+
+        RUNTIME: O(length)
+        """
+
+        positions = array.array(chooseIndexTypecode(length))
+        maxima = []
+        for start in range(0, length, self.blockSize):
+            block = range(start, min(start + self.blockSize, length))
+            values = PeakProblem.getLineValues(problem, axis, index, block)
+            best = findMaximumIndex(values)
+            positions.append(start + best)
+            maxima.append(values[best])
+        return (positions, buildSparseTable(maxima))
+
+    def isValid(self):
+        """
+        Returns true if no cell has been changed through set() since the
+        index was built.
+
+        RUNTIME: O(1)
+        """
+
+        return self.version.count == self.count
+
+    def findLineMaximum(self, problem, axis, index, positions):
+        """
+        Returns the position of the greatest value at the given contiguous
+        positions along one row or column of the given problem (which may be
+        a subproblem of the one the index was built from), in the problem's
+        own coordinates.  Returns None if the index is out of date, does not
+        cover those positions, or if they do not span a whole block (in
+        which case scanning them is as fast as using the index).  The cells
+        are read through the problem, so that a CountingPeakProblem counts
+        them.
+
+        RUNTIME: O(blockSize)
+        """
+
+        if not problem.version is self.version or not self.isValid():
+            return None
+        if len(positions) == 0:
+            return None
+
+        if axis == ROW:
+            (numLines, numPositions) = (problem.numRow, problem.numCol)
+            line = problem.startRow + index - self.startRow
+            shift = problem.startCol - self.startCol
+            (tables, length) = (self.rowTables, self.numCol)
+        else:
+            (numLines, numPositions) = (problem.numCol, problem.numRow)
+            line = problem.startCol + index - self.startCol
+            shift = problem.startRow - self.startRow
+            (tables, length) = (self.colTables, self.numRow)
+
+        (first, last) = (positions[0], positions[-1])
+        if not (0 <= index and index < numLines):
+            return None
+        if not (0 <= first and last < numPositions):
+            return None
+        if not (0 <= line and line < len(tables)):
+            return None
+        if not (0 <= first + shift and last + shift < length):
+            return None
+
+        # the whole blocks inside the segment, in index coordinates
+        (start, stop) = (first + shift, last + shift + 1)
+        firstBlock = -(-start // self.blockSize)
+        lastBlock = stop // self.blockSize
+        if firstBlock >= lastBlock:
+            return None
+
+        def scan(begin, end):
+            values = problem.getLineValues(axis, index,
+                                           range(begin - shift, end - shift))
+            best = findMaximumIndex(values)
+            return (begin + best, values[best])
+
+        (blockPositions, levels) = tables[line]
+
+        def readBlock(block):
+            position = blockPositions[block] - shift
+            if axis == ROW:
+                return problem.get((index, position))
+            return problem.get((position, index))
+
+        candidates = []
+        if start < firstBlock * self.blockSize:
+            candidates.append(scan(start, firstBlock * self.blockSize))
+        (block, value) = findSparseTableMaximum(levels, firstBlock, lastBlock,
+                                                readBlock)
+        candidates.append((blockPositions[block], value))
+        if lastBlock * self.blockSize < stop:
+            candidates.append(scan(lastBlock * self.blockSize, stop))
+
+        (best, bestValue) = candidates[0]
+        for (position, value) in candidates[1:]:
+            if value > bestValue:
+                (best, bestValue) = (position, value)
+        return best - shift
+
+################################################################################
+########################### Coordinate Descriptors #############################
+################################################################################
+
+class CoordinateProduct(object):
+    """
+    A lazy description of all pairs with one item from a sequence of rows and
+    one item from a sequence of columns (their Cartesian product), in the
+    order of a nested loop over the rows and then the columns.  The pairs are
+    only generated when the descriptor is iterated.
+    """
+
+    def __init__(self, rows, cols):
+        """
+        Creates a descriptor for the product of the two sequences.
+
+        RUNTIME: O(1)
+        """
+
+        self.rows = rows
+        self.cols = cols
+
+    def __len__(self):
+        return len(self.rows) * len(self.cols)
+
+    def __iter__(self):
+        for r in self.rows:
+            for c in self.cols:
+                yield (r, c)
+
+    def getLine(self):
+        """
+        If the product lies along a single row or column, and its positions
+        along that line form a range, returns (axis, index, positions).
+        Otherwise, returns None.
+
+        RUNTIME: O(1)
+        """
+
+        if len(self.rows) == 1 and isinstance(self.cols, range):
+            return (ROW, self.rows[0], self.cols)
+        if len(self.cols) == 1 and isinstance(self.rows, range):
+            return (COLUMN, self.cols[0], self.rows)
+        return None
+
+class CoordinateChain(object):
+    """
+    A lazy description of the locations of several descriptors (or lists of
+    locations), one after another.
+    """
+
+    def __init__(self, parts):
+        """
+        Creates a descriptor for the concatenation of the given parts.
+
+        RUNTIME: O(1)
+        """
+
+        self.parts = parts
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            for loc in part:
+                yield loc
+
 ################################################################################
 ################################ Helper Methods ################################
 ################################################################################
@@ -158,13 +1019,154 @@ def getDimensions(array):
     
     return (rows, cols)
 
+def findMaximumIndex(values):
+    """
+    Returns the index of the first occurrence of the greatest value in the
+    given sequence, or None if the sequence is empty.
+
+    RUNTIME: O(len(values))
+    """
+
+    if len(values) == 0:
+        return None
+    if not hasattr(values, "index"):
+        values = values.tolist()
+    return values.index(max(values))
+
+def findTilePeaks(tile):
+    """
+    Returns the list of peaks in a tile produced by PeakProblem.getTile(),
+    as locations in the problem the tile was taken from.  A cell is a peak if
+    none of its neighbors (including those in the halo rows) is greater.
+
+    RUNTIME: O(size of the tile)
+    """
+
+    (startRow, startCol, above, rows, below) = tile
+    peaks = []
+
+    for i in range(len(rows)):
+        row = rows[i]
+        up = rows[i - 1] if i > 0 else above
+        down = rows[i + 1] if i + 1 < len(rows) else below
+
+        # first find the cells that are at least as large as the cells to
+        # their left and right, then check those against the rows around them
+        last = len(row) - 1
+        candidates = [c for c in range(len(row))
+                      if (c == 0 or row[c - 1] <= row[c]) and
+                         (c == last or row[c + 1] <= row[c])]
+        for c in candidates:
+            if not up is None and up[c] > row[c]:
+                continue
+            if not down is None and down[c] > row[c]:
+                continue
+            peaks.append((startRow + i, startCol + c))
+
+    return peaks
+
+def chooseIndexTypecode(size):
+    """
+    Returns the narrowest array typecode that can hold every index into a
+    sequence of the given size.
+
+    RUNTIME: O(1)
+    """
+
+    if size <= 1 << 16:
+        return "H"
+    return "L"
+
+def buildSparseTable(values):
+    """
+    Builds the sparse table of a sequence of values, as a list of levels,
+    where levels[k][i] is the position of the first greatest value among
+    positions i to i + 2^k - 1.  The values themselves are not kept.
+
+    RUNTIME: O(len(values) * log(len(values)))
+    """
+
+    typecode = chooseIndexTypecode(len(values))
+    levels = [range(len(values))]
+    width = 1
+    while 2 * width <= len(values):
+        previous = levels[-1]
+        levels.append(array.array(typecode, [
+            left if values[left] >= values[right] else right
+            for (left, right) in zip(previous, previous[width:])]))
+        width *= 2
+
+    return levels
+
+def findSparseTableMaximum(levels, start, stop, read):
+    """
+    Returns the pair (position, value) of the first greatest value among
+    positions start to stop - 1 (which must not be empty) of a table from
+    buildSparseTable().  The values are read by calling read(position), at
+    most twice.
+
+    RUNTIME: O(1)
+    """
+
+    k = (stop - start).bit_length() - 1
+    left = levels[k][start]
+    right = levels[k][stop - (1 << k)]
+    leftValue = read(left)
+    if left == right:
+        return (left, leftValue)
+    rightValue = read(right)
+    if leftValue >= rightValue:
+        return (left, leftValue)
+    return (right, rightValue)
+
+def flatten(matrix, rows, cols):
+    """
+    Copies a two-dimensional array into a flat, row-major array.array of
+    machine integers (or doubles, if the matrix holds any non-integers).
+    Rows shorter than the given number of columns are padded with zeros.
+    Falls back to a flat list if the values do not fit in a machine word.
+
+    RUNTIME: O(rows * cols)
+    """
+
+    typecode = "q"
+    for row in matrix:
+        for value in row:
+            if not isinstance(value, int):
+                typecode = "d"
+
+    flat = []
+    for row in matrix:
+        flat.extend(row)
+        flat.extend([0] * (cols - len(row)))
+
+    try:
+        return array.array(typecode, flat)
+    except OverflowError:
+        return flat
+
+def createCountingProblem(problem):
+    """
+    Constructs a CountingPeakProblem over the same storage and bounds as the
+    given problem, with a new counter.
+
+    RUNTIME: O(1)
+    """
+
+    counting = CountingPeakProblem(problem.array, problem.bounds,
+                                   problem.stride)
+    counting.index = problem.index
+    counting.version = problem.version
+    return counting
+
 def createProblem(array):
     """
     Constructs an instance of the PeakProblem object for the given array,
     using bounds derived from the array using the getDimensions function.
+    The array is copied into compact row-major storage.
    
-    RUNTIME: O(len(array))
+    RUNTIME: O(rows * cols)
     """
 
     (rows, cols) = getDimensions(array)
-    return PeakProblem(array, (0, 0, rows, cols))
+    return PeakProblem.from_buffer(flatten(array, rows, cols), rows, cols)
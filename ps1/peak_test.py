@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import peak
+import algorithms
+import problemfile
+import trace
+
+class PeakTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def _randomMatrix(self, rows, cols):
+        return [[random.randint(0, 5) for c in range(cols)]
+                for r in range(rows)]
+
+    def _bruteForcePeaks(self, matrix):
+        # every location without a strictly greater neighbor, in row-major
+        # order
+        peaks = []
+        for r in range(len(matrix)):
+            for c in range(len(matrix[r])):
+                neighbors = [(r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)]
+                if all(matrix[nr][nc] <= matrix[r][c]
+                       for (nr, nc) in neighbors
+                       if 0 <= nr < len(matrix) and 0 <= nc < len(matrix[r])):
+                    peaks.append((r, c))
+        return peaks
+
+    def _bruteForceTopPeaks(self, problem):
+        # every peak from highest to lowest, with ties in row-major order
+        peaks = self._bruteForcePeaks(problem.getMatrix())
+        return sorted(peaks, key = lambda location:
+                      (-problem.get(location), location))
+
+    def testIndexMatchesScan(self):
+        for trial in range(100):
+            (rows, cols) = (random.randint(1, 30), random.randint(1, 30))
+            matrix = self._randomMatrix(rows, cols)
+            indexed = peak.createProblem(matrix)
+            indexed.buildIndex(random.choice([1, 2, 3, 5]))
+            plain = peak.createProblem(matrix)
+            for query in range(20):
+                (sRow, sCol) = (random.randrange(rows), random.randrange(cols))
+                bounds = (sRow, sCol, random.randint(1, rows - sRow),
+                          random.randint(1, cols - sCol))
+                self.assertEqual(algorithms.peakInRegion(indexed, bounds),
+                                 algorithms.peakInRegion(plain, bounds))
+                sub = indexed.getSubproblem(bounds)
+                for r in range(bounds[2]):
+                    self.assertEqual(sub.getLineMaximum(peak.ROW, r),
+                                     plain.getSubproblem(bounds).
+                                     getLineMaximum(peak.ROW, r))
+
+    def testIndexSeesWritesThroughOtherViews(self):
+        problem = peak.createProblem([[1, 2, 3, 0], [0, 0, 0, 0]])
+        child = problem.getSubproblem((0, 0, 2, 4))
+        child.buildIndex(1)
+        problem.set((0, 0), 100)
+        self.assertEqual(child.getLineMaximum(peak.ROW, 0), (0, 0))
+
+        child.buildIndex(1)
+        sibling = problem.getSubproblem((0, 1, 2, 3))
+        sibling.set((0, 2), 200)
+        self.assertEqual(child.getLineMaximum(peak.ROW, 0), (0, 3))
+
+        problem.buildIndex(1)
+        counting = peak.createCountingProblem(problem)
+        counting.getSubproblem((1, 0, 1, 4)).set((0, 1), 300)
+        self.assertEqual(problem.getLineMaximum(peak.COLUMN, 1), (1, 1))
+
+    def testSubproblemBoundsAreChecked(self):
+        problem = peak.createProblem(self._randomMatrix(10, 10))
+        for bounds in [(0, 5, 3, 10), (8, 0, 3, 10), (-1, 0, 2, 2),
+                       (0, -1, 2, 2), (0, 0, -1, 2), (10, 0, 1, 1)]:
+            self.assertRaises(ValueError, problem.getSubproblem, bounds)
+            self.assertRaises(ValueError, algorithms.peakInRegion, problem,
+                              bounds)
+
+        sub = problem.getSubproblem((2, 3, 8, 7))
+        self.assertRaises(ValueError, sub.getSubproblem, (0, 0, 8, 8))
+        self.assertEqual(sub.getSubproblem((8, 7, 0, 0)).numRow, 0)
+
+    def testIterativeMatchesRecursive(self):
+        pairs = [(algorithms.algorithm1, algorithms.iterativeAlgorithm1),
+                 (algorithms.algorithm2, algorithms.iterativeAlgorithm2),
+                 (algorithms.algorithm3, algorithms.iterativeAlgorithm3),
+                 (algorithms.algorithm4, algorithms.iterativeAlgorithm4)]
+        for trial in range(50):
+            (rows, cols) = (random.randint(0, 20), random.randint(0, 20))
+            problem = peak.createProblem(self._randomMatrix(rows, cols))
+            for (recursive, iterative) in pairs:
+                (expected, actual) = (trace.TraceRecord(), trace.TraceRecord())
+                self.assertEqual(iterative(problem, trace = actual),
+                                 recursive(problem, trace = expected))
+                self.assertEqual(actual.sequence, expected.sequence)
+
+    def testAllPeaksMatchBruteForce(self):
+        for trial in range(30):
+            (rows, cols) = (random.randint(1, 20), random.randint(1, 20))
+            matrix = self._randomMatrix(rows, cols)
+            problem = peak.createProblem(matrix)
+            expected = self._bruteForcePeaks(matrix)
+            for tileRows in [None, 1, 2, 3, 7, rows, rows + 1]:
+                self.assertEqual(list(problem.allPeaks(tileRows)), expected)
+
+            (sRow, sCol) = (random.randrange(rows), random.randrange(cols))
+            bounds = (sRow, sCol, random.randint(1, rows - sRow),
+                      random.randint(1, cols - sCol))
+            self.assertEqual(problem.getRegionPeaks(bounds),
+                             [(r, c) for (r, c) in expected
+                              if sRow <= r < sRow + bounds[2] and
+                                 sCol <= c < sCol + bounds[3]])
+
+        matrix = self._randomMatrix(37, 23)
+        problem = peak.createProblem(matrix)
+        self.assertEqual(list(problem.allPeaks(5, processes = 2)),
+                         self._bruteForcePeaks(matrix))
+
+    def testTopPeaksMatchBruteForce(self):
+        for trial in range(30):
+            (rows, cols) = (random.randint(0, 12), random.randint(0, 12))
+            problem = peak.createProblem(self._randomMatrix(rows, cols))
+            tree = algorithms.buildMaximumTree(problem,
+                                               random.choice([1, 2, 5, 4096]))
+
+            expected = self._bruteForceTopPeaks(problem)
+            for k in range(len(expected) + 3):
+                self.assertEqual(algorithms.topPeaks(problem, k, tree),
+                                 expected[:k])
+
+            if rows == 0 or cols == 0:
+                continue
+            edits = [(random.randrange(rows), random.randrange(cols),
+                      random.randint(0, 9)) for i in range(3)]
+            problem.update(edits)
+            expected = self._bruteForceTopPeaks(problem)
+            self.assertEqual(algorithms.topPeaks(problem, len(expected) + 1),
+                             expected)
+
+    def testBinaryProblemRoundTrip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "problem.bin")
+            matrices = [self._randomMatrix(7, 5),
+                        [[-3, 2 ** 40], [7]],
+                        [[0.5, 1], [2, -1.25]],
+                        [[200, 300, 70000]],
+                        []]
+            for matrix in matrices:
+                problemfile.writeMatrix(filename, matrix)
+                self.assertTrue(problemfile.isBinaryProblem(filename))
+                problem = problemfile.loadProblem(filename)
+
+                (rows, cols) = peak.getDimensions(matrix)
+                self.assertEqual((problem.numRow, problem.numCol),
+                                 (rows, cols))
+                for r in range(rows):
+                    for c in range(cols):
+                        expected = matrix[r][c] if c < len(matrix[r]) else 0
+                        self.assertEqual(problem.get((r, c)), expected)
+                self.assertEqual(problem.getMatrix(),
+                                 peak.createProblem(matrix).getMatrix())
+
+            self.assertRaises(ValueError, problemfile.writeProblem, filename,
+                              2, 2, "i", [[1, 2, 3]])
+            with open(filename, "wb") as handle:
+                handle.write(b"PEAK")
+            self.assertRaises(ValueError, problemfile.loadProblem, filename)
+        finally:
+            shutil.rmtree(directory)
+
+    def testUpdateChecksBeforeWriting(self):
+        problem = peak.createProblem([[1, 2], [3, 4]])
+        self.assertRaises(TypeError, problem.update, [(0, 0, 9), (1, 1, 2.5)])
+        self.assertRaises(IndexError, problem.update, [(0, 0, 9)], (5, 5))
+        self.assertEqual(problem.getMatrix(), [[1, 2], [3, 4]])
+        self.assertRaises(IndexError, problem.update, [], (5, 5))
+        self.assertEqual(problem.update([(1, 0, 9)], (1, 1)), (1, 0))
+
+    def testCountingAttributesEachCellOnce(self):
+        plain = peak.createProblem(self._randomMatrix(50, 50))
+        problem = peak.createCountingProblem(plain)
+        problem.getCrossMaximum(10, 20)
+        self.assertEqual(problem.counter.getSummary(),
+                         {"getMaximum" : {"calls" : 1, "lookups" : 99}})
+
+        problem.counter.reset()
+        problem.getBetterNeighbor((10, 20))
+        self.assertEqual(problem.counter.lookups, 5)
+
+        problem.counter.reset()
+        list(problem.allPeaks())
+        self.assertEqual(problem.counter.getSummary(),
+                         {"getTile" : {"calls" : 1, "lookups" : 2500}})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import sys
+import mmap
+import array
+import struct
+import peak
+
+################################################################################
+############################# Binary Problem Files #############################
+################################################################################
+
+# A binary problem file starts with a fixed-size header:
+#
+#     magic      4 bytes   the bytes "PEAK"
+#     version    1 byte    the format version (currently 1)
+#     typecode   1 byte    the array typecode of the values, e.g. "q" or "d"
+#     itemsize   1 byte    the size of one value in bytes
+#     (padding)  1 byte
+#     rows       8 bytes   the number of rows in the matrix
+#     cols       8 bytes   the number of columns in the matrix
+#
+# and is followed directly by the rows * cols values of the matrix, in
+# row-major order.  All numbers are stored little-endian.
+
+MAGIC = b"PEAK"
+VERSION = 1
+HEADER = struct.Struct("<4sBcBxQQ")
+
+# the typecodes whose sizes are the same on every supported platform
+TYPECODES = {"b" : 1, "B" : 1, "h" : 2, "H" : 2, "i" : 4, "I" : 4,
+             "q" : 8, "Q" : 8, "f" : 4, "d" : 8}
+
+def isBinaryProblem(filename):
+    """
+    Returns true if the given file starts with the binary problem magic.
+    """
+
+    with open(filename, "rb") as handle:
+        return handle.read(len(MAGIC)) == MAGIC
+
+def chooseTypecode(minimum, maximum):
+    """
+    Returns the smallest integer typecode that can hold every value between
+    minimum and maximum (inclusive).
+    """
+
+    for typecode in ("B", "b", "H", "h", "I", "i", "Q", "q"):
+        bits = 8 * TYPECODES[typecode]
+        if typecode.isupper():
+            (low, high) = (0, 2 ** bits - 1)
+        else:
+            (low, high) = (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+        if low <= minimum and maximum <= high:
+            return typecode
+    raise OverflowError("Values do not fit in a 64-bit integer")
+
+def writeHeader(handle, rows, cols, typecode):
+    """
+    Writes the header of a binary problem file to an open file.
+    """
+
+    if not typecode in TYPECODES:
+        raise ValueError("Unsupported typecode %r" % typecode)
+    handle.write(HEADER.pack(MAGIC, VERSION, typecode.encode("ascii"),
+                             TYPECODES[typecode], rows, cols))
+
+def writeValues(handle, typecode, values):
+    """
+    Appends a chunk of values to an open binary problem file.
+    """
+
+    chunk = array.array(typecode, values)
+    if sys.byteorder != "little":
+        chunk.byteswap()
+    chunk.tofile(handle)
+
+def writeProblem(filename, rows, cols, typecode, chunks):
+    """
+    Writes a binary problem file.  The values of the matrix are given as an
+    iterable of chunks, each of which is a sequence of values, so that the
+    whole matrix never needs to be held in memory.  Together the chunks must
+    hold exactly rows * cols values in row-major order.
+    """
+
+    count = 0
+    with open(filename, "wb") as handle:
+        writeHeader(handle, rows, cols, typecode)
+        for chunk in chunks:
+            writeValues(handle, typecode, chunk)
+            count += len(chunk)
+
+    if count != rows * cols:
+        raise ValueError("Wrote %d values for a %d x %d matrix" %
+                         (count, rows, cols))
+
+def writeMatrix(filename, matrix):
+    """
+    Writes a two-dimensional array (a list of rows) as a binary problem file,
+    using the smallest integer typecode that fits its values, or doubles if
+    it holds any non-integers.  Short rows are padded with zeros.
+    """
+
+    (rows, cols) = peak.getDimensions(matrix)
+    values = [value for row in matrix for value in row]
+
+    if all(isinstance(value, int) for value in values):
+        typecode = chooseTypecode(min(values + [0]), max(values + [0]))
+    else:
+        typecode = "d"
+
+    chunks = (list(row) + [0] * (cols - len(row)) for row in matrix)
+    writeProblem(filename, rows, cols, typecode, chunks)
+
+def readHeader(handle):
+    """
+    Reads and checks the header of an open binary problem file.  Returns the
+    triple (rows, cols, typecode).
+    """
+
+    header = handle.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Binary problem file header is truncated")
+
+    (magic, version, typecode, itemsize, rows, cols) = HEADER.unpack(header)
+    typecode = typecode.decode("ascii")
+    if magic != MAGIC:
+        raise ValueError("Not a binary problem file")
+    if version != VERSION:
+        raise ValueError("Unsupported binary problem version %d" % version)
+    if TYPECODES.get(typecode) != itemsize:
+        raise ValueError("Unsupported typecode %r" % typecode)
+
+    return (rows, cols, typecode)
+
+def loadProblem(filename):
+    """
+    Opens a binary problem file as a PeakProblem.  The file is memory-mapped
+    rather than read, so opening it takes constant time, and only the pages
+    holding the cells that an algorithm looks at are ever read from disk.
+    On a big-endian machine the values are instead copied and byte-swapped.
+    """
+
+    with open(filename, "rb") as handle:
+        (rows, cols, typecode) = readHeader(handle)
+        size = rows * cols * TYPECODES[typecode]
+
+        if size == 0:
+            return peak.PeakProblem.from_buffer(array.array(typecode), rows,
+                                                cols)
+
+        mapping = mmap.mmap(handle.fileno(), 0, access = mmap.ACCESS_READ)
+
+    view = memoryview(mapping)[HEADER.size:HEADER.size + size]
+    if len(view) < size:
+        raise ValueError("Binary problem file is truncated")
+
+    if sys.byteorder == "little":
+        buffer = view.cast(typecode)
+    else:
+        buffer = array.array(typecode)
+        buffer.frombytes(view.tobytes())
+        buffer.byteswap()
+
+    return peak.PeakProblem.from_buffer(buffer, rows, cols)
@@ -1,3 +1,4 @@
+import json
 import peak
 
 ################################################################################
@@ -19,20 +20,30 @@ class TraceRecord(object):
 
         self.sequence = []
 
+    def record(self, event):
+        """
+        Appends a single event to the trace.
+
+        RUNTIME: O(1)
+        """
+
+        self.sequence.append(event)
+
     def getMaximum(self, arguments, maximum):
         """
         A function for recording the fact that the getMaximum function of
-        some subproblem has been called.
+        some subproblem has been called.  The arguments may be a list of
+        locations or a lazy coordinate descriptor, which is expanded here.
 
-        RUNTIME: O(1)
+        RUNTIME: O(len(arguments))
         """
 
-        self.sequence.append({
+        self.record({
             "type" : "findingMaximum",
-            "coords" : arguments
+            "coords" : list(arguments)
         })
 
-        self.sequence.append({
+        self.record({
             "type" : "foundMaximum",
             "coord" : maximum
         })
@@ -45,13 +56,13 @@ class TraceRecord(object):
         RUNTIME: O(1)
         """
 
-        self.sequence.append({
+        self.record({
             "type" : "findingNeighbor",
             "coord" : neighbor
         })
 
         if (neighbor != better):
-            self.sequence.append({
+            self.record({
                 "type" : "foundNeighbor",
                 "coord" : better
             })
@@ -64,7 +75,7 @@ class TraceRecord(object):
         RUNTIME: O(1)
         """
 
-        self.sequence.append({
+        self.record({
             "type" : "subproblem",
             "startRow" : subproblem.startRow,
             "numRows" : subproblem.numRow,
@@ -80,7 +91,7 @@ class TraceRecord(object):
         RUNTIME: O(1)
         """
 
-        self.sequence.append({
+        self.record({
             "type" : "bestSeen",
             "coord" : bestSeen
         })
@@ -92,7 +103,179 @@ class TraceRecord(object):
         RUNTIME: O(1)
         """
 
-        self.sequence.append({
+        self.record({
             "type" : "foundPeak",
             "coord" : peak
         })
+
+################################################################################
+############################ Streaming Trace Output ############################
+################################################################################
+
+class StreamingTraceRecord(TraceRecord):
+    """
+    A trace of an algorithm that is written out to a file as it is recorded,
+    keeping at most bufferSize events in memory.  Instead of listing every
+    location, a getMaximum event stores its locations as runs (see
+    encodeRanges), which visualizer.html expands again.
+    """
+
+    def __init__(self, file, bufferSize = 1024):
+        """
+        Starts the trace, writing its opening bracket to the file.
+
+        RUNTIME: O(1)
+        """
+
+        TraceRecord.__init__(self)
+        self.file = file
+        self.bufferSize = bufferSize
+        self.written = 0
+        file.write("[")
+
+    def record(self, event):
+        """
+        Buffers a single event, writing out the buffer when it is full.
+
+        RUNTIME: O(1) amortized
+        """
+
+        self.sequence.append(event)
+        if len(self.sequence) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out all of the buffered events.
+
+        RUNTIME: O(size of the buffered events)
+        """
+
+        for event in self.sequence:
+            if self.written > 0:
+                self.file.write(", ")
+            json.dump(event, self.file)
+            self.written += 1
+        self.sequence = []
+
+    def close(self):
+        """
+        Writes out the remaining events and the closing bracket of the trace.
+
+        RUNTIME: O(size of the buffered events)
+        """
+
+        self.flush()
+        self.file.write("]")
+
+    def getMaximum(self, arguments, maximum):
+        """
+        A function for recording the fact that the getMaximum function of
+        some subproblem has been called, storing its locations as runs.
+
+        RUNTIME: O(1) for a row, column or cross; O(len(arguments)) otherwise
+        """
+
+        self.record({
+            "type" : "findingMaximum",
+            "ranges" : encodeRanges(arguments)
+        })
+
+        self.record({
+            "type" : "foundMaximum",
+            "coord" : maximum
+        })
+
+class TraceWriter(object):
+    """
+    A class for writing the trace file read by visualizer.html a piece at a
+    time: the input matrix, then the trace of each algorithm in turn, all in
+    the same parse({"input" : ..., "steps" : [...]}) envelope that is used
+    when the whole trace is dumped at once.
+    """
+
+    def __init__(self, file, problem, bufferSize = 1024):
+        """
+        Starts the trace file, writing out the matrix of the given problem
+        one row at a time.
+
+        RUNTIME: O(problem.numRow * problem.numCol)
+        """
+
+        self.file = file
+        self.bufferSize = bufferSize
+        self.algorithms = 0
+
+        file.write('parse({"input": [')
+        for r in range(problem.numRow):
+            if r > 0:
+                file.write(", ")
+            json.dump(list(problem.getRow(r)), file)
+        file.write('], "steps": [')
+
+    def startAlgorithm(self):
+        """
+        Returns a StreamingTraceRecord for the next algorithm.  It must be
+        closed before the next algorithm is started.
+
+        RUNTIME: O(1)
+        """
+
+        if self.algorithms > 0:
+            self.file.write(", ")
+        self.algorithms += 1
+        return StreamingTraceRecord(self.file, self.bufferSize)
+
+    def close(self):
+        """
+        Finishes the trace file.
+
+        RUNTIME: O(1)
+        """
+
+        self.file.write("]})")
+
+################################################################################
+################################ Helper Methods ################################
+################################################################################
+
+def encodeRanges(locations):
+    """
+    Encodes a sequence of locations as a list of runs [row, col, rowStep,
+    colStep, count], each standing for the count locations (row + i * rowStep,
+    col + i * colStep).  Lazy descriptors along a row or column are encoded
+    without generating their locations.
+
+    RUNTIME: O(1) for a row, column or cross; O(len(locations)) otherwise
+    """
+
+    if isinstance(locations, peak.CoordinateChain):
+        runs = []
+        for part in locations.parts:
+            runs.extend(encodeRanges(part))
+        return runs
+
+    if isinstance(locations, peak.CoordinateProduct):
+        line = locations.getLine()
+        if not line is None:
+            (axis, index, positions) = line
+            if len(positions) == 0:
+                return []
+            if axis == peak.ROW:
+                return [[index, positions[0], 0, positions.step,
+                         len(positions)]]
+            return [[positions[0], index, positions.step, 0, len(positions)]]
+
+    runs = []
+    for (r, c) in locations:
+        if len(runs) > 0:
+            run = runs[-1]
+            if run[4] == 1:
+                (run[2], run[3], run[4]) = (r - run[0], c - run[1], 2)
+                continue
+            if (r == run[0] + run[2] * run[4] and
+                c == run[1] + run[3] * run[4]):
+                run[4] += 1
+                continue
+        runs.append([r, c, 0, 0, 1])
+    return runs
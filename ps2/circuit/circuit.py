@@ -1,14 +1,39 @@
 #!/usr/bin/env python
 
+import array  # Used by CompiledCircuit
+import collections  # Used by CalendarQueue
+import csv    # Used by SimulationProfiler
+import gc     # Used by NetlistParser
+import hashlib  # Used by NetlistParser
+import heapq  # Used by HeapqQueue, CalendarQueue and CompiledSimulation
+import itertools  # Used by CompiledSimulation
 import json   # Used when TRACE=jsonp
+import mmap   # Used by NetlistParser
+import multiprocessing  # Used by BatchSimulation
 import os     # Used to get the TRACE environment variable
 import re     # Used when TRACE=jsonp
+import stat   # Used by NetlistParser
+import struct  # Used by CompiledCircuit and Simulation checkpoints
 import sys    # Used to smooth over the range / xrange issue.
+import timeit  # Used by Simulation checkpoints
 
 # Python 3 doesn't have xrange, and range behaves like xrange.
 if sys.version_info >= (3,):
     xrange = range
 
+# os.rename fails on Windows if the destination exists, unlike os.replace,
+# which Python 2 doesn't have.
+replace_file = getattr(os, 'replace', os.rename)
+
+# Typecode of the integer arrays in compiled circuit and checkpoint files.
+# Simulation times outgrow 32 bits, which is the size of 'l' on Windows.
+# Python 2 doesn't have 'q', but its 'l' has 64 bits on other platforms.
+try:
+    array.array('q')
+    WIDE_TYPECODE = 'q'
+except ValueError:
+    WIDE_TYPECODE = 'l'
+
 
 # Circuit simulation library.
 
@@ -29,15 +54,30 @@ class TruthTable:
         self.name = name
         self.table = self._build_table(output_list)
         self.input_count = self._table_depth(self.table)
+        self.bits = self._pack_table(output_list)
 
     def output(self, inputs):
         """Computes the output for this truth table, given a list of inputs."""
         if len(inputs) != self.input_count:
             raise ValueError('Inputs list is incorrectly sized')
-        value = self.table
+        index = 0
         for i in inputs:
-            value = value[i]
-        return value
+            index = (index << 1) | i
+        return (self.bits >> index) & 1
+
+    def output_at(self, index):
+        """Computes the output for this truth table, given its inputs packed
+        into an index.
+        
+        Does not check the number of inputs, so it costs a single shift and
+        mask.
+        
+        Args:
+            index: The inputs read as a binary number, with the first input as
+                the most significant bit; this is the entry's position in the
+                list the truth table was created from.
+        """
+        return (self.bits >> index) & 1
 
     def _build_table(self, output_list):
         # Builds an evaluation table out of a list of truth table values.
@@ -57,6 +97,14 @@ class TruthTable:
             return [self._build_table(output_list[0:half]),
                     self._build_table(output_list[half:])]
 
+    def _pack_table(self, output_list):
+        # Packs a list of truth table values into an integer, so that bit i of 
+        # the integer is the value at position i of the list.
+        bits = 0
+        for i in xrange(len(output_list)):
+            bits |= output_list[i] << i
+        return bits
+
     def _table_depth(self, table):
         # The depth (number of inputs) of a truth table.
         depth = 0
@@ -114,7 +162,7 @@ class Gate:
         """
         self.name = name
         self.gate_type = gate_type
-        self.in_gates = [None for i in xrange(gate_type.input_count)]
+        self.in_gates = [None] * gate_type.input_count
         self.out_gates = []
         self.probed = False
         self.output = 0
@@ -167,7 +215,10 @@ class Gate:
         a delay from its inputs' transitions to the output's transition. The 
         circuit simulator is responsible for setting the appropriate time. 
         """
-        return self.gate_type.output([gate.output for gate in self.in_gates])
+        index = 0
+        for gate in self.in_gates:
+            index = (index << 1) | gate.output
+        return self.gate_type.truth_table.output_at(index)
   
     def transition_time(self, input_time):
         """The time that the gate's output will reflect a change in its inputs.
@@ -190,12 +241,17 @@ class Circuit:
     This class contains topological information about a circuit (how the gates 
     are connected to each other) as well as information about the gates' states
     (values at their output terminals) at an instance of time.
+    
+    A gate can only be added after the gates feeding it, so gate_list, which
+    holds the gates in the order they were added, is in topological order.
+    (The gates dictionary is not ordered on Python 2.)
     """
     def __init__(self):
         """Creates an empty circuit."""
         self.truth_tables = {}
         self.gate_types = {}
         self.gates = {}
+        self.gate_list = []
 
     def add_truth_table(self, name, output_list):
         """Adds a truth table that can be later attached to gate types.
@@ -246,6 +302,7 @@ class Circuit:
             raise ValueError('Gate name already used')
         gate_type = self.gate_types[type_name]
         self.gates[name] = new_gate = Gate(name, gate_type)
+        self.gate_list.append(new_gate)
         for i in xrange(len(input_names)):
             gate = self.gates[input_names[i]]
             new_gate.connect_input(gate, i)
@@ -259,7 +316,7 @@ class Circuit:
     def as_json(self):
         """A hash that obeys the JSON format, representing the circuit."""
         json = {}
-        json['gates'] = [gate.as_json() for gate in self.gates.itervalues()]
+        json['gates'] = [gate.as_json() for gate in self.gate_list]
         return json
 
 class Transition:
@@ -448,11 +505,164 @@ class PriorityQueue():
     def min(self):
         return self.heap[0]
 
+    def transitions(self):
+        # The queued elements, in no particular order.
+        return list(self.heap)
+
+
+class HeapqQueue:
+    """Priority queue of Transitions, kept as a heapq of tuples.
+    
+    Each Transition is stored as a (time, object_id, transition) tuple, so the
+    heap orders Transitions by comparing integers, without calling
+    Transition.__lt__.
+    """
+    
+    def __init__(self):
+        """Initially empty priority queue."""
+        self.heap = []
+    
+    def __len__(self):
+        # Number of elements in the queue.
+        return len(self.heap)
+    
+    def append(self, transition):
+        """Inserts a Transition in the priority queue."""
+        heapq.heappush(self.heap, (transition.time, transition.object_id,
+                                   transition))
+    
+    def min(self):
+        """The earliest Transition in the queue."""
+        return self.heap[0][2]
+    
+    def transitions(self):
+        """The queued Transitions, in no particular order."""
+        return [entry[2] for entry in self.heap]
+    
+    def pop(self):
+        """Removes the earliest Transition in the queue.
+        
+        Returns:
+            The removed Transition, or None if the queue is empty.
+        """
+        if len(self.heap) == 0:
+            return None
+        return heapq.heappop(self.heap)[2]
+
+class CalendarQueue:
+    """Priority queue of Transitions, bucketed by time.
+    
+    Transitions that happen at the same time share a bucket, which is a FIFO
+    queue. Transitions are created right before they are queued, so each
+    bucket is already sorted by object_id. A heap holds the times of the 
+    non-empty buckets. When gate delays come from a small set of values, the 
+    transitions queued at any moment fall in a few buckets, so appending to or
+    popping from an existing bucket costs O(1), and the heap stays tiny.
+    """
+    
+    def __init__(self):
+        """Initially empty priority queue."""
+        self.buckets = {}
+        self.times = []
+        self.length = 0
+    
+    def __len__(self):
+        # Number of elements in the queue.
+        return self.length
+    
+    def append(self, transition):
+        """Inserts a Transition in the priority queue.
+        
+        Raises:
+            ValueError: An exception if the Transition was created before a 
+                Transition already queued at the same time.
+        """
+        bucket = self.buckets.get(transition.time)
+        if bucket is None:
+            self.buckets[transition.time] = bucket = collections.deque()
+            heapq.heappush(self.times, transition.time)
+        elif bucket[-1].object_id > transition.object_id:
+            raise ValueError('Transitions must be queued in creation order')
+        bucket.append(transition)
+        self.length += 1
+    
+    def min(self):
+        """The earliest Transition in the queue."""
+        return self.buckets[self.times[0]][0]
+    
+    def transitions(self):
+        """The queued Transitions, in no particular order."""
+        return [transition for bucket in self.buckets.values()
+                for transition in bucket]
+    
+    def pop(self):
+        """Removes the earliest Transition in the queue.
+        
+        Returns:
+            The removed Transition, or None if the queue is empty.
+        """
+        if self.length == 0:
+            return None
+        time = self.times[0]
+        bucket = self.buckets[time]
+        transition = bucket.popleft()
+        if len(bucket) == 0:
+            del self.buckets[time]
+            heapq.heappop(self.times)
+        self.length -= 1
+        return transition
+
+# The event queue implementations that Simulation can use, by name.
+QUEUES = {'heap': PriorityQueue, 'heapq': HeapqQueue, 'calendar': CalendarQueue}
 
-class Simulation:
+
+class ProbeResults:
+    """The probe results of a simulation, and the ways to write them out.
+    
+    Simulation and CompiledSimulation keep their probe results in the probes
+    list, as [time, gate name, output] entries sorted when run() finishes,
+    unless the results are streamed to a ProbeWriter (see stream_probes).
+    """
+    
+    def stream_probes(self, writer):
+        """Sends the probe results to a ProbeWriter as they are produced.
+        
+        The results are then written out during run(), instead of being kept
+        in the probes list, so outputs_to_line_list(), outputs_to_file() and
+        Simulation.jsonp_to_file() raise a ValueError afterwards.
+        
+        Args:
+            writer: The ProbeWriter that receives the probe results.
+        """
+        self.probes = writer
+    
+    def outputs_to_line_list(self):
+        return [' '.join([str(probe[0]), probe[1], str(probe[2])])
+                for probe in self._probe_list()]
+    
+    def _probe_list(self):
+        # The probe results, unless they were streamed (see stream_probes).
+        if not isinstance(self.probes, list):
+            raise ValueError('Probe results were streamed to a ProbeWriter')
+        return self.probes
+    
+    def outputs_to_file(self, file):
+        """Writes a textual description of the simulation's probe results to a 
+        file.
+        
+        Args:
+            file: A File object that receives the probe results.
+        """
+        for line in self.outputs_to_line_list():
+            file.write(line)
+            file.write("\n")
+
+
+class Simulation(ProbeResults):
     """State needed to compute a circuit's state as it evolves over time."""
     
-    def __init__(self, circuit):
+    def __init__(self, circuit, queue='heap', cancel_transitions=True,
+                 profiler=None):
         """Creates a simulation that will run on a pre-built circuit.
         
         The Circuit instance does not need to be completely built before it is 
@@ -461,13 +671,38 @@ class Simulation:
         
         Args:
             circuit: The circuit whose state transitions will be simulated.
+            queue: The name of the event queue implementation to use (a key in
+                QUEUES): 'heap' (PriorityQueue), 'heapq' (HeapqQueue) or
+                'calendar' (CalendarQueue). All of them produce the same
+                results.
+            cancel_transitions: If True, transitions that are certain to be 
+                invalid when popped are dropped instead of being queued (see
+                queue_transition). This does not change the results.
+            profiler: A SimulationProfiler that records the simulation's
+                activity, or None.
+        
+        Raises:
+            ValueError: An exception if the queue name is unknown.
         """
         self.circuit = circuit
         self.in_transitions = []
         
-        self.queue = PriorityQueue()
+        if queue not in QUEUES:
+            raise ValueError('Unknown event queue ' + repr(queue))
+        self.queue = QUEUES[queue]()
+        self.cancel_transitions = cancel_transitions
+        # Maps each gate with pending transitions to its latest one.
+        self.last_pending = {}
+        self.queued_count = 0
+        self.cancelled_count = 0
+        self.queue_high_water_mark = 0
+        self.profiler = profiler
         self.probes = []
         self.probe_all_undo_log = []
+        # True once the initial transitions have been queued by run().
+        self.inputs_queued = False
+        # SHA-1 digest of the netlist commands, set by from_file().
+        self.netlist_hash = None
 
     def add_transition(self, gate_name, output_value, output_time):
         """Adds a transition to the simulation's initial conditions.
@@ -491,8 +726,12 @@ class Simulation:
         
         # Need to apply all the transitions at the same time before propagating.
         transitions = []
+        popped = 0
         while len(self.queue) > 0 and self.queue.min().time == step_time:
           transition = self.queue.pop()
+          popped += 1
+          if self.last_pending.get(transition.gate) is transition:
+            del self.last_pending[transition.gate]
           if not transition.is_valid():
             continue
           transition.apply()
@@ -506,26 +745,295 @@ class Simulation:
           for gate in transition.gate.out_gates:
             output = gate.transition_output()
             time = gate.transition_time(step_time)
-            self.queue.append(Transition(gate, output, time))
+            self.queue_transition(Transition(gate, output, time))
         
+        if self.profiler is not None:
+          self.profiler.record_step(step_time, popped, transitions,
+                                    len(self.queue))
         return step_time
     
-    def run(self):
-        """Runs the simulation to completion."""
-        for in_transition in sorted(self.in_transitions):
-            self.queue.append(Transition(in_transition[3], in_transition[2],
-                                         in_transition[0]))
+    def queue_transition(self, transition):
+        """Adds a transition to the event queue, unless it is superseded.
+        
+        A transition is superseded if it will not change its gate's output
+        when it is popped. That is certain when its gate has no pending
+        transitions and the gate's output already has the new value, or when
+        the gate's latest pending transition is no later than this one and
+        has the same new value: by the time this transition is popped, the
+        gate's output will have that value. Superseded transitions are
+        counted as cancelled, and are not queued if cancel_transitions is on.
+        
+        Args:
+            transition: The Transition to be queued.
+        """
+        gate = transition.gate
+        last = self.last_pending.get(gate)
+        if last is None:
+            superseded = gate.output == transition.new_output
+        elif last.time <= transition.time:
+            superseded = last.new_output == transition.new_output
+        else:
+            # Only transitions queued in time order can be compared.
+            self.queue.append(transition)
+            self._count_queued(transition)
+            return
+        
+        if superseded:
+            self.cancelled_count += 1
+            if self.profiler is not None:
+                self.profiler.record_transition(transition, False)
+            if self.cancel_transitions:
+                return
+        self.last_pending[gate] = transition
+        self.queue.append(transition)
+        self._count_queued(transition)
+    
+    def _count_queued(self, transition):
+        # Updates the queue statistics after a transition is queued.
+        self.queued_count += 1
+        if len(self.queue) > self.queue_high_water_mark:
+            self.queue_high_water_mark = len(self.queue)
+        if self.profiler is not None:
+            self.profiler.record_transition(transition, True)
+    
+    def queue_stats(self):
+        """Statistics about the event queue, as a dictionary.
+        
+        The statistics are 'queued', the number of transitions added to the
+        queue; 'cancelled', the number of superseded transitions (which were
+        not queued, if cancel_transitions is on); and 'high_water_mark', the
+        largest number of transitions that were in the queue at once.
+        """
+        return {'queued': self.queued_count,
+                'cancelled': self.cancelled_count,
+                'high_water_mark': self.queue_high_water_mark}
+    
+    def run(self, checkpoint_path=None, checkpoint_seconds=60):
+        """Runs the simulation to completion.
+        
+        A simulation restored by load_checkpoint() carries on from where its
+        checkpoint was taken.
+        
+        Args:
+            checkpoint_path: If given, the simulation is checkpointed to this
+                file (see save_checkpoint) every checkpoint_seconds seconds. 
+                The file is written under a temporary name and then renamed,
+                so that a crash never leaves a partially written checkpoint.
+            checkpoint_seconds: The time between checkpoints, in seconds. A
+                checkpoint takes time proportional to the number of pending
+                transitions and probe results (a second or two per million),
+                and the simulation is paused meanwhile, so intervals much
+                shorter than the default 60 seconds slow large runs down.
+        """
+        if not self.inputs_queued:
+            for in_transition in sorted(self.in_transitions):
+                self.queue_transition(Transition(in_transition[3],
+                                                 in_transition[2],
+                                                 in_transition[0]))
+            self.inputs_queued = True
+        last_checkpoint = timeit.default_timer()
         while len(self.queue) > 0:
             self.step()
-        self.probes.sort()
+            if (checkpoint_path is not None and timeit.default_timer() - 
+                    last_checkpoint >= checkpoint_seconds):
+                temporary = checkpoint_path + '.' + str(os.getpid()) + '.tmp'
+                try:
+                    with open(temporary, 'wb') as file:
+                        self.save_checkpoint(file)
+                    replace_file(temporary, checkpoint_path)
+                except BaseException:
+                    try:
+                        os.remove(temporary)
+                    except EnvironmentError:
+                        pass
+                    raise
+                last_checkpoint = timeit.default_timer()
+        if isinstance(self.probes, list):
+            self.probes.sort()
+        else:
+            self.probes.flush()
+    
+    # A checkpoint file starts with a header holding: the magic bytes 'CSIM',
+    # the format version, the size of the integers in the file's arrays, their
+    # byte order (0 for little-endian, 1 for big-endian), the number of gates,
+    # the number of pending transitions, the number of probe results, the 
+    # queue statistics (queued, cancelled and high water mark), and the SHA-1
+    # digest of the netlist commands. It is followed by the gate outputs (one
+    # byte per gate), the pending transitions as the integer arrays of their
+    # times and gate numbers and a byte of flags for each (bit 0 is the new
+    # output, bit 1 is set if the transition is its gate's entry in
+    # last_pending), and the probe results as the integer arrays of their
+    # times and gate numbers and a byte for each output. Gates are numbered in
+    # the order of Circuit.gate_list, and transitions are stored in the order
+    # they will be popped.
+    CHECKPOINT_MAGIC = b'CSIM'
+    CHECKPOINT_VERSION = 2
+    CHECKPOINT_HEADER = struct.Struct('<4sBBBxQQQQQQ20s')
+    
+    def save_checkpoint(self, file):
+        """Writes the state of a running simulation to a file.
+        
+        The state is the gates' outputs, the pending transitions and the probe
+        results produced so far. It can be restored by load_checkpoint() in a
+        simulation read from the same netlist. Profiler data is not saved.
+        
+        Args:
+            file: A File object opened for writing in binary mode.
+        
+        Raises:
+            ValueError: An exception if the probe results are streamed (see
+                stream_probes), as they cannot be saved, or if the simulation
+                was not read by from_file(), so its netlist is unknown.
+        """
+        if not isinstance(self.probes, list):
+            raise ValueError('Streamed probe results cannot be checkpointed')
+        if self.netlist_hash is None:
+            raise ValueError('Only simulations read by from_file can be '
+                             'checkpointed')
+        gates = self.circuit.gate_list
+        numbers = dict((gates[i].name, i) for i in xrange(len(gates)))
+        
+        # List the pending transitions in pop order, without popping them.
+        pending = sorted(self.queue.transitions(),
+                         key=lambda t: (t.time, t.object_id))
+        
+        file.write(self.CHECKPOINT_HEADER.pack(
+            self.CHECKPOINT_MAGIC, self.CHECKPOINT_VERSION,
+            array.array(WIDE_TYPECODE).itemsize,
+            0 if sys.byteorder == 'little' else 1, len(gates), len(pending),
+            len(self.probes), self.queued_count, self.cancelled_count,
+            self.queue_high_water_mark, self.netlist_hash))
+        file.write(bytearray([gate.output for gate in gates]))
+        array.array(WIDE_TYPECODE, [t.time for t in pending]).tofile(file)
+        array.array(WIDE_TYPECODE,
+                    [numbers[t.gate.name] for t in pending]).tofile(file)
+        file.write(bytearray(
+            [t.new_output | (2 if self.last_pending.get(t.gate) is t else 0)
+             for t in pending]))
+        array.array(WIDE_TYPECODE,
+                    [probe[0] for probe in self.probes]).tofile(file)
+        array.array(WIDE_TYPECODE,
+                    [numbers[probe[1]] for probe in self.probes]).tofile(file)
+        file.write(bytearray([probe[2] for probe in self.probes]))
+    
+    def load_checkpoint(self, file):
+        """Restores the state saved by save_checkpoint().
+        
+        The simulation must have been read by from_file() from the same 
+        netlist as the one that was checkpointed, and must not have been run.
+        Calling run() afterwards finishes the checkpointed simulation.
+        
+        Args:
+            file: A File object opened for reading in binary mode.
+        
+        Raises:
+            ValueError: An exception if the file is not a checkpoint of this
+                simulation's netlist, or if the simulation has already started.
+        """
+        if self.inputs_queued or len(self.queue) > 0:
+            raise ValueError('Simulation has already started')
+        header = file.read(self.CHECKPOINT_HEADER.size)
+        if len(header) != self.CHECKPOINT_HEADER.size:
+            raise ValueError('Checkpoint file is truncated')
+        (magic, version, itemsize, byteorder, gate_count, pending_count,
+            probe_count, queued_count, cancelled_count, high_water_mark,
+            digest) = self.CHECKPOINT_HEADER.unpack(header)
+        if magic != self.CHECKPOINT_MAGIC:
+            raise ValueError('Not a checkpoint file')
+        if version != self.CHECKPOINT_VERSION:
+            raise ValueError('Unsupported checkpoint version')
+        if (itemsize != array.array(WIDE_TYPECODE).itemsize or
+                byteorder != (0 if sys.byteorder == 'little' else 1)):
+            raise ValueError('Checkpoint written by another platform')
+        gates = self.circuit.gate_list
+        if self.netlist_hash is None or digest != self.netlist_hash:
+            raise ValueError('Checkpoint was taken from another netlist')
+        if gate_count != len(gates):
+            raise ValueError('Checkpoint file has an invalid gate count')
+        
+        def read_bytes(size):
+            data = bytearray(file.read(size))
+            if len(data) != size:
+                raise ValueError('Checkpoint file is truncated')
+            return data
+        
+        def read_array(count):
+            values = array.array(WIDE_TYPECODE)
+            try:
+                values.fromfile(file, count)
+            except EOFError:
+                raise ValueError('Checkpoint file is truncated')
+            return values
+        
+        outputs = read_bytes(gate_count)
+        pending_times = read_array(pending_count)
+        pending_gates = read_array(pending_count)
+        pending_flags = read_bytes(pending_count)
+        probe_times = read_array(probe_count)
+        probe_gates = read_array(probe_count)
+        probe_outputs = read_bytes(probe_count)
+        
+        for number in xrange(gate_count):
+            gates[number].output = outputs[number]
+        for i in xrange(pending_count):
+            gate = gates[pending_gates[i]]
+            transition = Transition(gate, pending_flags[i] & 1,
+                                    pending_times[i])
+            if pending_flags[i] & 2:
+                self.last_pending[gate] = transition
+            self.queue.append(transition)
+        self.probes = [[probe_times[i], gates[probe_gates[i]].name, 
+                        probe_outputs[i]] for i in xrange(probe_count)]
+        self.queued_count = queued_count
+        self.cancelled_count = cancelled_count
+        self.queue_high_water_mark = high_water_mark
+        self.inputs_queued = True
+    
+    def stream_jsonp_to_file(self, file):
+        """Starts a JSONP description of the simulation's probe results.
+        
+        Writes the circuit and its layout to the file, and streams the probe
+        results after them as they are produced (see stream_probes). The 
+        description is complete once the returned ProbeWriter is closed.
+        
+        Args:
+            file: A File object that receives the description.
+        
+        Returns:
+            The ProbeWriter that receives the probe results.
+        """
+        file.write('onJsonp({"circuit": ')
+        json.dump(self.circuit.as_json(), file)
+        file.write(', "layout": ')
+        json.dump(self.layout_svg, file)
+        file.write(', "trace": [')
+        writer = ProbeWriter(file, 'json', ']});\n')
+        self.stream_probes(writer)
+        return writer
             
     def probe_all_gates(self):
         """Turns on probing for all gates in the simulation."""
-        for gate in self.circuit.gates.itervalues():
+        for gate in self.circuit.gate_list:
             if not gate.probed:
                 self.probe_all_undo_log.append(gate)
                 gate.probe()
 
+    def compile(self):
+        """A CompiledSimulation equivalent to this simulation.
+        
+        The compiled simulation starts from the circuit's current gate outputs
+        and probes, and from this simulation's initial transitions. Running it
+        produces the same probe results as running this simulation.
+        
+        Returns:
+            A new CompiledSimulation instance.
+        """
+        simulation = CompiledSimulation(CompiledCircuit(self.circuit))
+        for in_transition in self.in_transitions:
+            simulation.add_transition(in_transition[1], in_transition[2],
+                                      in_transition[0])
+        return simulation
+
     def undo_probe_all_gates(self):
         """Reverts the effects of calling probe_all_gates!"""  
         for gate in self.probe_all_undo_log:
@@ -533,44 +1041,28 @@ class Simulation:
         self.probe_all_undo_log = []
     
     @staticmethod
-    def from_file(file):
+    def from_file(file, queue='heap'):
         """Builds a simulation by reading a textual description from a file.
         
+        The description ends at a 'done' line, or at the end of the file. See
+        NetlistParser for details.
+        
         Args:
             file: A File object supplying the input.
+            queue: The name of the event queue implementation to use (see
+                Simulation.__init__).
         
         Returns: A new Simulation instance.
+        
+        Raises:
+            ValueError: An exception if the description is invalid. The message
+                starts with the number of the offending line.
         """
         circuit = Circuit()
-        simulation = Simulation(circuit)
-        
-        while True:
-            command = file.readline().split()
-            if len(command) < 1:
-                continue
-            if command[0] == 'table':
-                outputs = [int(token) for token in command[2:]]
-                circuit.add_truth_table(command[1], outputs)
-            elif command[0] == 'type':
-                if len(command) != 4:
-                    raise ValueError('Invalid number of arguments for gate type'
-                                     ' command')
-                circuit.add_gate_type(command[1], command[2], int(command[3]))
-            elif command[0] == 'gate':
-                circuit.add_gate(command[1], command[2], command[3:])
-            elif command[0] == 'probe':
-                if len(command) != 2:
-                    raise ValueError('Invalid number of arguments for gate '
-                                      'probe command')
-                circuit.add_probe(command[1])
-            elif command[0] == 'flip':
-                if len(command) != 4:
-                    raise ValueError('Invalid number of arguments for flip '
-                                     'command')
-                simulation.add_transition(command[1], int(command[2]), 
-                                          int(command[3]))
-            elif command[0] == 'done':
-                break
+        simulation = Simulation(circuit, queue)
+        parser = NetlistParser(simulation)
+        parser.parse_file(file)
+        simulation.netlist_hash = parser.hash.digest()
         return simulation
     
     def layout_from_file(self, file):
@@ -597,23 +1089,9 @@ class Simulation:
     
     def trace_as_json(self):
         """A hash that obeys the JSON format, containing simulation data."""
-        return {'circuit': self.circuit.as_json(), 'trace': self.probes,
+        return {'circuit': self.circuit.as_json(), 'trace': self._probe_list(),
                 'layout': self.layout_svg}
     
-    def outputs_to_line_list(self):
-        return [' '.join([str(probe[0]), probe[1], str(probe[2])]) for probe in self.probes]
-    
-    def outputs_to_file(self, file):
-        """Writes a textual description of the simulation's probe results to a 
-        file.
-        
-        Args:
-            file: A File object that receives the probe results.
-        """
-        for line in self.outputs_to_line_list():
-            file.write(line)
-            file.write("\n")
-            
     def jsonp_to_file(self, file):
         """Writes a JSONP description of the simulation's probe results to a 
         file.
@@ -625,17 +1103,1040 @@ class Simulation:
         json.dump(self.trace_as_json(), file)
         file.write(');\n')
 
+class ProbeWriter:
+    """Writes a simulation's probe results to a file as they are produced.
+    
+    Simulation steps happen in time order, so probe results arrive in time 
+    order too, but several steps can happen at the same time when gates have
+    no delay. The writer keeps the results that share the latest time, and 
+    writes them out, sorted like Simulation.run() sorts its probes list, once
+    a result with a later time arrives. Its memory use is therefore bounded
+    by the number of results at a single time, rather than by the length of
+    the simulation.
+    """
+    
+    def __init__(self, file, format='text', suffix=''):
+        """Creates a writer for a file.
+        
+        Args:
+            file: A File object that receives the probe results.
+            format: 'text' to write one result per line, in the format of
+                Simulation.outputs_to_file, or 'json' to write the results as
+                JSON arrays separated by commas.
+            suffix: Text written when the writer is closed.
+        """
+        if format not in ('text', 'json'):
+            raise ValueError('Unknown probe format ' + repr(format))
+        self.file = file
+        self.format = format
+        self.suffix = suffix
+        self.time = None
+        self.pending = []
+        self.count = 0
+    
+    def append(self, probe):
+        """Adds a probe result, given as a [time, gate name, output] list.
+        
+        Raises:
+            ValueError: An exception if the result is earlier than the results
+                already written.
+        """
+        if probe[0] != self.time:
+            if self.time is not None and probe[0] < self.time:
+                raise ValueError('Probe results must arrive in time order')
+            self.flush()
+            self.time = probe[0]
+        self.pending.append(probe)
+    
+    def flush(self):
+        """Writes out the results kept so far."""
+        self.pending.sort()
+        for probe in self.pending:
+            if self.format == 'text':
+                self.file.write(' '.join([str(probe[0]), probe[1],
+                                          str(probe[2])]))
+                self.file.write('\n')
+            else:
+                if self.count > 0:
+                    self.file.write(', ')
+                json.dump(probe, self.file)
+            self.count += 1
+        self.pending = []
+    
+    def close(self):
+        """Writes out the results kept so far, and the suffix."""
+        self.flush()
+        self.file.write(self.suffix)
+
+class SimulationProfiler:
+    """Activity counters recorded by a Simulation as it runs.
+    
+    For every gate, the profiler counts the evaluations of the gate (one for 
+    each transition applied to one of its inputs), the transitions queued for
+    it, the transitions counted as cancelled because they were superseded (see
+    Simulation.queue_transition), and the transitions applied to its output.
+    Superseded transitions are counted as cancelled even if cancel_transitions
+    is off, in which case they are counted as queued too. For every step, it records the step's time, the
+    number of transitions popped and applied, and the length of the queue at
+    the end of the step.
+    """
+    
+    # The columns of the per-gate and per-step reports.
+    GATE_FIELDS = ['gate', 'evaluations', 'queued', 'cancelled', 'applied']
+    STEP_FIELDS = ['time', 'popped', 'applied', 'queue_length']
+    
+    def __init__(self):
+        """Creates a profiler with no activity recorded."""
+        self.gates = {}
+        self.steps = []
+    
+    def _counters(self, gate):
+        # The list of counters of a gate, in the order of GATE_FIELDS.
+        counters = self.gates.get(gate.name)
+        if counters is None:
+            self.gates[gate.name] = counters = [gate.name, 0, 0, 0, 0]
+        return counters
+    
+    def record_step(self, time, popped, transitions, queue_length):
+        """Records a step of the simulation.
+        
+        Args:
+            time: The step's time.
+            popped: The number of transitions popped from the queue.
+            transitions: The transitions that were applied.
+            queue_length: The length of the queue after the step.
+        """
+        for transition in transitions:
+            self._counters(transition.gate)[4] += 1
+            for gate in transition.gate.out_gates:
+                self._counters(gate)[1] += 1
+        self.steps.append([time, popped, len(transitions), queue_length])
+    
+    def record_transition(self, transition, queued):
+        """Records a transition that was queued, or superseded.
+        
+        Args:
+            transition: The Transition.
+            queued: True if the transition was queued, False if it was 
+                superseded. A superseded transition that is queued anyway is
+                recorded once with each value.
+        """
+        self._counters(transition.gate)[2 if queued else 3] += 1
+    
+    def gate_rows(self):
+        """The per-gate counters, busiest gates first.
+        
+        Returns:
+            A list of rows, each a list of values in the order of GATE_FIELDS,
+            sorted by decreasing number of evaluations.
+        """
+        return sorted(self.gates.values(), key=lambda row: (-row[1], row[0]))
+    
+    def totals(self):
+        """The counters summed over all gates and steps, as a dictionary."""
+        totals = {'steps': len(self.steps), 'max_queue_length': 0}
+        for i in xrange(1, len(self.GATE_FIELDS)):
+            totals[self.GATE_FIELDS[i]] = sum(
+                row[i] for row in self.gates.values())
+        if len(self.steps) > 0:
+            totals['max_queue_length'] = max(step[3] for step in self.steps)
+        return totals
+    
+    def as_json(self):
+        """A hash that obeys the JSON format, containing the report."""
+        return {'totals': self.totals(),
+                'gates': [dict(zip(self.GATE_FIELDS, row))
+                          for row in self.gate_rows()],
+                'steps': [dict(zip(self.STEP_FIELDS, step))
+                          for step in self.steps]}
+    
+    def to_json_file(self, file):
+        """Writes the report to a file, as JSON.
+        
+        Args:
+            file: A File object that receives the report.
+        """
+        json.dump(self.as_json(), file)
+        file.write('\n')
+    
+    def gates_to_csv(self, file):
+        """Writes the per-gate counters to a file, as CSV.
+        
+        Args:
+            file: A File object that receives the counters.
+        """
+        writer = csv.writer(file)
+        writer.writerow(self.GATE_FIELDS)
+        writer.writerows(self.gate_rows())
+    
+    def steps_to_csv(self, file):
+        """Writes the per-step records to a file, as CSV.
+        
+        Args:
+            file: A File object that receives the records.
+        """
+        writer = csv.writer(file)
+        writer.writerow(self.STEP_FIELDS)
+        writer.writerows(self.steps)
+
+class NetlistParser:
+    """Reads the textual description of a circuit and its initial transitions.
+    
+    The description has one command per line (see tests/README.txt), and ends
+    with a 'done' line, or with the end of the file. Lines with unknown 
+    commands, such as comments, are ignored. Files on disk that are at least
+    MMAP_THRESHOLD bytes long are memory-mapped and scanned in place; other 
+    files are read line by line. Either way, the file is left right after the
+    'done' line, so that the layout that follows it can be read.
+    
+    Building a large circuit allocates millions of objects, none of which are
+    garbage, so the garbage collector is paused while a file is parsed. This
+    halves the time needed to read a million-gate circuit.
+    
+    The netlist commands are hashed as they are parsed, so that a netlist can
+    be recognized later (see NetlistCache and Simulation.load_checkpoint).
+    """
+    
+    # Files at least this large are memory-mapped instead of being read.
+    MMAP_THRESHOLD = 1 << 20
+    
+    # The commands that make up a netlist.
+    NETLIST_COMMANDS = ('table', 'type', 'gate', 'probe')
+    
+    def __init__(self, simulation):
+        """Creates a parser that adds what it reads to a simulation.
+        
+        Args:
+            simulation: The Simulation that receives the transitions, and whose
+                circuit receives the truth tables, gate types, gates and probes.
+                A CompiledSimulation can only receive transitions.
+        """
+        self.simulation = simulation
+        self.commands = {'table': self.parse_table, 'type': self.parse_type,
+                         'gate': self.parse_gate, 'probe': self.parse_probe,
+                         'flip': self.parse_flip}
+        self.hash = hashlib.sha1()
+    
+    def parse_file(self, file):
+        """Reads commands from a file, up to a 'done' line or the end of file.
+        
+        Args:
+            file: A File object supplying the input.
+        
+        Returns:
+            True if the commands ended with a 'done' line.
+        
+        Raises:
+            ValueError: An exception if a command is invalid.
+        """
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            mapping = self._map_file(file)
+            if mapping is None:
+                return self.parse_lines(iter(file.readline, ''))
+            try:
+                done = self.parse_lines(iter(mapping.readline, b''), 'utf-8')
+                file.seek(mapping.tell())
+            finally:
+                mapping.close()
+            return done
+        finally:
+            if collecting:
+                gc.enable()
+    
+    def parse_lines(self, lines, encoding=None):
+        """Reads commands from a sequence of lines, up to a 'done' line.
+        
+        Args:
+            lines: An iterable of lines; lines are strings, or bytes if an
+                encoding is given.
+            encoding: The encoding used to decode the lines, if they are bytes.
+        
+        Returns:
+            True if the commands ended with a 'done' line.
+        
+        Raises:
+            ValueError: An exception if a command is invalid.
+        """
+        line_number = 0
+        for line in lines:
+            line_number += 1
+            if encoding is not None:
+                line = line.decode(encoding)
+            command = line.split()
+            if len(command) < 1:
+                continue
+            if command[0] == 'done':
+                return True
+            self.parse_command(line_number, command)
+        return False
+    
+    def parse_command(self, line_number, command):
+        """Handles one command, given as a list of tokens.
+        
+        Args:
+            line_number: The number of the line holding the command, used in
+                error messages.
+            command: The command's tokens; unknown commands are ignored.
+        
+        Raises:
+            ValueError: An exception if the command is invalid.
+        """
+        parse = self.commands.get(command[0])
+        if parse is None:
+            return
+        if command[0] in self.NETLIST_COMMANDS:
+            self.hash_command(command)
+        try:
+            parse(command)
+        except KeyError as error:
+            raise ValueError('Line ' + str(line_number) + ': unknown name ' +
+                             str(error))
+        except (IndexError, RuntimeError, TypeError, ValueError) as error:
+            raise ValueError('Line ' + str(line_number) + ': ' + str(error))
+    
+    def hash_command(self, command):
+        """Adds a netlist command, given as a list of tokens, to the hash."""
+        self.hash.update((' '.join(command) + '\n').encode('utf-8'))
+    
+    def parse_table(self, command):
+        """Handles a 'table' command, given as a list of tokens."""
+        outputs = [int(token) for token in command[2:]]
+        self.simulation.circuit.add_truth_table(command[1], outputs)
+    
+    def parse_type(self, command):
+        """Handles a 'type' command, given as a list of tokens."""
+        if len(command) != 4:
+            raise ValueError('Invalid number of arguments for gate type'
+                             ' command')
+        self.simulation.circuit.add_gate_type(command[1], command[2],
+                                              int(command[3]))
+    
+    def parse_gate(self, command):
+        """Handles a 'gate' command, given as a list of tokens."""
+        if len(command) < 3:
+            raise ValueError('Invalid number of arguments for gate command')
+        self.simulation.circuit.add_gate(command[1], command[2], command[3:])
+    
+    def parse_probe(self, command):
+        """Handles a 'probe' command, given as a list of tokens."""
+        if len(command) != 2:
+            raise ValueError('Invalid number of arguments for gate '
+                              'probe command')
+        self.simulation.circuit.add_probe(command[1])
+    
+    def parse_flip(self, command):
+        """Handles a 'flip' command, given as a list of tokens."""
+        if len(command) != 4:
+            raise ValueError('Invalid number of arguments for flip '
+                             'command')
+        self.simulation.add_transition(command[1], int(command[2]), 
+                                       int(command[3]))
+    
+    def _map_file(self, file):
+        # Memory-maps the rest of a large file on disk, positioned where the 
+        # file object would read next. Returns None for anything else.
+        try:
+            status = os.fstat(file.fileno())
+            if (not stat.S_ISREG(status.st_mode) or
+                    status.st_size < self.MMAP_THRESHOLD):
+                return None
+            position = file.tell()
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+        mapping.seek(position)
+        return mapping
+
+class CompiledCircuit:
+    """A circuit flattened into integer arrays, for fast simulation.
+    
+    Gates are numbered in the order they were added to the circuit (the
+    topological order of Circuit.gate_list), and every per-gate property is
+    stored in an array indexed by gate number, so that simulating the circuit
+    does not look up any Gate attributes. Connections
+    are stored in compressed sparse row form: the inputs of gate g are
+    in_gates[in_offsets[g]:in_offsets[g + 1]], in terminal order, and the
+    gates that g's output is connected to are
+    out_gates[out_offsets[g]:out_offsets[g + 1]], in connection order. Truth
+    tables are flattened into the tables bytearray; the output of gate g for
+    the inputs read as a binary number i (the first input being the most
+    significant bit) is tables[table_offsets[g] + i].
+    """
+    
+    def __init__(self, circuit=None):
+        """Flattens a completely built circuit.
+        
+        Args:
+            circuit: The Circuit instance to be flattened. Its gates' current
+                outputs become the initial outputs of the compiled circuit. If
+                None, the compiled circuit is empty.
+        
+        Raises:
+            ValueError: An exception if a gate has some, but not all, of its
+                inputs connected. (Gates without any connected inputs are 
+                circuit inputs, and are never evaluated.)
+        """
+        if circuit is None:
+            circuit = Circuit()
+        gates = circuit.gate_list
+        self.names = [gate.name for gate in gates]
+        self.numbers = dict((gates[i].name, i) for i in xrange(len(gates)))
+        self.outputs = bytearray([gate.output for gate in gates])
+        self.probed = bytearray([1 if gate.probed else 0 for gate in gates])
+        self.delays = array.array(WIDE_TYPECODE,
+                                  [gate.gate_type.delay for gate in gates])
+        
+        # Flatten every truth table once, and point each gate at its table.
+        tables = bytearray()
+        offsets = {}
+        for table in circuit.truth_tables.values():
+            offsets[table.name] = len(tables)
+            tables.extend(self._flatten_table(table))
+        self.tables = tables
+        self.table_offsets = array.array(WIDE_TYPECODE,
+            [offsets[gate.gate_type.truth_table.name] for gate in gates])
+        
+        numbers = self.numbers
+        in_offsets = [0]
+        in_gates = []
+        fan_out = [[] for gate in gates]
+        for number in xrange(len(gates)):
+            gate = gates[number]
+            if gate.has_inputs_connected():
+                for in_gate in gate.in_gates:
+                    in_number = numbers[in_gate.name]
+                    in_gates.append(in_number)
+                    fan_out[in_number].append(number)
+            else:
+                for in_gate in gate.in_gates:
+                    if in_gate is not None:
+                        raise ValueError('Gate ' + gate.name + ' has '
+                                         'unconnected inputs')
+            in_offsets.append(len(in_gates))
+        self.in_offsets = array.array(WIDE_TYPECODE, in_offsets)
+        self.in_gates = array.array(WIDE_TYPECODE, in_gates)
+        
+        # Gates are numbered in the order of Circuit.gate_list, so each gate's
+        # output connections are listed in the order they were made.
+        out_offsets = [0]
+        out_gates = []
+        for outputs in fan_out:
+            out_gates.extend(outputs)
+            out_offsets.append(len(out_gates))
+        self.out_offsets = array.array(WIDE_TYPECODE, out_offsets)
+        self.out_gates = array.array(WIDE_TYPECODE, out_gates)
+    
+    def _flatten_table(self, truth_table):
+        # The outputs of a truth table, for inputs counting up from all 0s.
+        return [truth_table.output_at(index)
+                for index in xrange(2 ** truth_table.input_count)]
+    
+    # A compiled circuit file starts with a header holding: the magic bytes
+    # 'CCKT', the format version, the size of the integers in the file's 
+    # arrays, their byte order (0 for little-endian, 1 for big-endian), the
+    # number of gates, the number of gate inputs, the size of the flattened 
+    # truth tables, and the size of the gate names. It is followed by the gate
+    # names (UTF-8, separated by newlines), then the bytes of outputs, probed 
+    # and tables, and then the integer arrays delays, table_offsets, 
+    # in_offsets, in_gates, out_offsets and out_gates. Files older than
+    # version 3 may number gates out of topological order.
+    MAGIC = b'CCKT'
+    VERSION = 3
+    HEADER = struct.Struct('<4sBBBxQQQQ')
+    
+    def save(self, file):
+        """Writes the compiled circuit to a file, in a compact binary format.
+        
+        Args:
+            file: A File object opened for writing in binary mode.
+        """
+        names = '\n'.join(self.names).encode('utf-8')
+        file.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                    self.delays.itemsize,
+                                    0 if sys.byteorder == 'little' else 1,
+                                    len(self.names), len(self.in_gates),
+                                    len(self.tables), len(names)))
+        file.write(names)
+        file.write(self.outputs)
+        file.write(self.probed)
+        file.write(self.tables)
+        for values in (self.delays, self.table_offsets, self.in_offsets,
+                       self.in_gates, self.out_offsets, self.out_gates):
+            values.tofile(file)
+    
+    @staticmethod
+    def load(file):
+        """Reads a compiled circuit written by save().
+        
+        Args:
+            file: A File object opened for reading in binary mode.
+        
+        Returns:
+            A new CompiledCircuit instance.
+        
+        Raises:
+            ValueError: An exception if the file is not a compiled circuit, or
+                was written by a different version or kind of machine.
+        """
+        header = file.read(CompiledCircuit.HEADER.size)
+        if len(header) != CompiledCircuit.HEADER.size:
+            raise ValueError('Compiled circuit file is truncated')
+        (magic, version, itemsize, byteorder, gate_count, input_count,
+            table_size, names_size) = CompiledCircuit.HEADER.unpack(header)
+        if magic != CompiledCircuit.MAGIC:
+            raise ValueError('Not a compiled circuit file')
+        if version != CompiledCircuit.VERSION:
+            raise ValueError('Unsupported compiled circuit version')
+        if (itemsize != array.array(WIDE_TYPECODE).itemsize or
+                byteorder != (0 if sys.byteorder == 'little' else 1)):
+            raise ValueError('Compiled circuit written by another platform')
+        
+        compiled = CompiledCircuit()
+        
+        def read_bytes(size):
+            data = bytearray(file.read(size))
+            if len(data) != size:
+                raise ValueError('Compiled circuit file is truncated')
+            return data
+        
+        def read_array(count):
+            values = array.array(WIDE_TYPECODE)
+            try:
+                values.fromfile(file, count)
+            except EOFError:
+                raise ValueError('Compiled circuit file is truncated')
+            return values
+        
+        names = read_bytes(names_size).decode('utf-8')
+        compiled.names = names.split('\n') if gate_count > 0 else []
+        if len(compiled.names) != gate_count:
+            raise ValueError('Compiled circuit file has invalid gate names')
+        compiled.numbers = dict((compiled.names[i], i) 
+                                for i in xrange(gate_count))
+        compiled.outputs = read_bytes(gate_count)
+        compiled.probed = read_bytes(gate_count)
+        compiled.tables = read_bytes(table_size)
+        compiled.delays = read_array(gate_count)
+        compiled.table_offsets = read_array(gate_count)
+        compiled.in_offsets = read_array(gate_count + 1)
+        compiled.in_gates = read_array(input_count)
+        compiled.out_offsets = read_array(gate_count + 1)
+        compiled.out_gates = read_array(input_count)
+        return compiled
+
+class CompiledSimulation(ProbeResults):
+    """A Simulation that runs on a CompiledCircuit.
+    
+    Produces the same probe results as Simulation, but keeps all its state in
+    flat arrays, and queues transitions as (time, order, gate number, new
+    output) tuples in a heapq, where order is the number of transitions queued
+    before. Transitions at the same time are therefore applied in the order
+    they were queued, as in Simulation.
+    """
+    
+    def __init__(self, compiled):
+        """Creates a simulation that will run on a compiled circuit.
+        
+        Args:
+            compiled: The CompiledCircuit whose state transitions will be 
+                simulated. Its arrays are shared, not modified.
+        """
+        self.compiled = compiled
+        self.outputs = bytearray(compiled.outputs)
+        self.in_transitions = []
+        
+        self.queue = []
+        self.order = itertools.count()
+        self.probes = []
+    
+    def add_transition(self, gate_name, output_value, output_time):
+        """Adds a transition to the simulation's initial conditions.
+        
+        The transition should involve one of the circuit's input gates.
+        """
+        gate = self.compiled.numbers[gate_name]
+        self.in_transitions.append([output_time, gate_name, output_value, gate])
+    
+    def step(self):
+        """Runs the simulation for one time slice.
+        
+        Behaves like Simulation.step().
+        
+        Returns:
+            The simulation time after the step occurred.
+        """
+        compiled = self.compiled
+        outputs = self.outputs
+        queue = self.queue
+        step_time = queue[0][0]
+        
+        # Need to apply all the transitions at the same time before propagating.
+        changed = []
+        while len(queue) > 0 and queue[0][0] == step_time:
+            (time, order, gate, new_output) = heapq.heappop(queue)
+            if outputs[gate] == new_output:
+                continue
+            outputs[gate] = new_output
+            if compiled.probed[gate]:
+                self.probes.append([time, compiled.names[gate], new_output])
+            changed.append(gate)
+        
+        # Propagate the transition effects.
+        in_offsets = compiled.in_offsets
+        in_gates = compiled.in_gates
+        out_offsets = compiled.out_offsets
+        tables = compiled.tables
+        table_offsets = compiled.table_offsets
+        delays = compiled.delays
+        order = self.order
+        for gate in changed:
+            for out_gate in compiled.out_gates[out_offsets[gate]:
+                                               out_offsets[gate + 1]]:
+                index = 0
+                for in_gate in in_gates[in_offsets[out_gate]:
+                                        in_offsets[out_gate + 1]]:
+                    index = (index << 1) | outputs[in_gate]
+                heapq.heappush(queue, (step_time + delays[out_gate],
+                                       next(order), out_gate,
+                                       tables[table_offsets[out_gate] + index]))
+        
+        return step_time
+    
+    def run(self):
+        """Runs the simulation to completion."""
+        for in_transition in sorted(self.in_transitions):
+            if in_transition[2] != 0 and in_transition[2] != 1:
+                raise ValueError('Invalid output value')
+            heapq.heappush(self.queue, (in_transition[0], next(self.order),
+                                        in_transition[3], in_transition[2]))
+        while len(self.queue) > 0:
+            self.step()
+        if isinstance(self.probes, list):
+            self.probes.sort()
+        else:
+            self.probes.flush()
+    
+
+class NetlistCache:
+    """A directory of compiled circuits, keyed by a hash of their netlists.
+    
+    The netlist of a textual circuit description is made up of its 'table',
+    'type', 'gate' and 'probe' commands. Its 'flip' commands (the stimulus)
+    are not part of the netlist, and neither are comments or spacing, so the
+    same circuit run with different stimuli is compiled only once. The
+    compiled circuit is saved as <hash>.circuit in the cache directory.
+    """
+    
+    # The suffix of compiled circuit files.
+    SUFFIX = '.circuit'
+    
+    def __init__(self, directory):
+        """Creates a cache that keeps its files in the given directory.
+        
+        Args:
+            directory: The directory's path. It is created if needed.
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+    
+    def path(self, key):
+        """The path of the compiled circuit file for a netlist hash."""
+        return os.path.join(self.directory, key + self.SUFFIX)
+    
+    def load_simulation(self, file):
+        """Builds a compiled simulation from a textual description in a file.
+        
+        The netlist is hashed as it is read. If the cache holds a compiled
+        circuit with that hash, the circuit is loaded from it without being 
+        built; otherwise the circuit is built, compiled, and saved in the
+        cache.
+        
+        Args:
+            file: A File object supplying the input (see 
+                Simulation.from_file).
+        
+        Returns:
+            A new CompiledSimulation instance, with the file's initial 
+            transitions.
+        
+        Raises:
+            ValueError: An exception if the description is invalid.
+        """
+        reader = NetlistReader()
+        reader.parse_file(file)
+        key = reader.hash.hexdigest()
+        path = self.path(key)
+        
+        compiled = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as cached:
+                    compiled = CompiledCircuit.load(cached)
+                self.hits += 1
+            except (EnvironmentError, ValueError):
+                # Stale or damaged files are rebuilt.
+                compiled = None
+        if compiled is None:
+            self.misses += 1
+            # As in NetlistParser.parse_file, nothing built here is garbage.
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                simulation = Simulation(Circuit())
+                parser = NetlistParser(simulation)
+                for (line_number, command) in reader.netlist:
+                    parser.parse_command(line_number, command)
+                compiled = CompiledCircuit(simulation.circuit)
+            finally:
+                if collecting:
+                    gc.enable()
+            self.save(compiled, path)
+        
+        simulation = CompiledSimulation(compiled)
+        parser = NetlistParser(simulation)
+        for (line_number, command) in reader.stimulus:
+            parser.parse_command(line_number, command)
+        return simulation
+    
+    def save(self, compiled, path):
+        """Saves a compiled circuit in the cache.
+        
+        The file is written under a temporary name and then renamed, so that
+        other processes never load a partially written file.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temporary = path + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as file:
+            compiled.save(file)
+        replace_file(temporary, path)
+
+class NetlistReader(NetlistParser):
+    """A parser that hashes a netlist and collects its commands.
+    
+    Used by NetlistCache. The netlist commands are kept, with their line
+    numbers, in netlist, and the 'flip' commands in stimulus, so that either 
+    can be handed to a NetlistParser later.
+    """
+    
+    def __init__(self):
+        """Creates a reader with an empty hash."""
+        NetlistParser.__init__(self, None)
+        self.netlist = []
+        self.stimulus = []
+    
+    def parse_command(self, line_number, command):
+        """Hashes and keeps a netlist command, or keeps a 'flip' command."""
+        if command[0] in self.NETLIST_COMMANDS:
+            self.hash_command(command)
+            self.netlist.append((line_number, command))
+        elif command[0] == 'flip':
+            self.stimulus.append((line_number, command))
+
+class BatchSimulation:
+    """Runs one circuit against many independent stimuli.
+    
+    The circuit is built and compiled once. Each stimulus is a file whose 
+    'flip' commands give a run's initial transitions (its other commands are 
+    ignored, so complete circuit descriptions work too), and each run's probe
+    results are written to a separate output file. The runs are spread over a
+    pool of worker processes. Each worker receives the CompiledCircuit when it
+    starts; where processes are forked, the circuit's arrays are shared with 
+    the parent instead of being copied. Every run keeps its gate outputs in 
+    its own CompiledSimulation, so runs never see each other's state.
+    """
+    
+    def __init__(self, compiled):
+        """Creates a batch that runs on a compiled circuit.
+        
+        Args:
+            compiled: The CompiledCircuit to be simulated, e.g. the compiled
+                attribute of a CompiledSimulation built by a NetlistCache.
+        """
+        self.compiled = compiled
+    
+    @staticmethod
+    def from_file(file):
+        """Builds a batch from a textual circuit description in a file.
+        
+        The description's 'flip' commands are ignored.
+        
+        Args:
+            file: A File object supplying the input (see 
+                Simulation.from_file).
+        
+        Returns:
+            A new BatchSimulation instance.
+        """
+        simulation = Simulation.from_file(file)
+        return BatchSimulation(CompiledCircuit(simulation.circuit))
+    
+    def run(self, stimulus_filenames, output_filenames=None, processes=None):
+        """Runs the circuit once for every stimulus file.
+        
+        Args:
+            stimulus_filenames: The names of the files holding the stimuli.
+            output_filenames: The names of the files that receive each run's 
+                probe results, in the format of Simulation.outputs_to_file. By
+                default, each stimulus file's name with its .in extension (if 
+                any) replaced by .out.
+            processes: The number of worker processes; by default, one per CPU.
+                With a single process, the runs happen in this process.
+        
+        Returns:
+            A list with a (stimulus filename, output filename, error) triple 
+            for every run, in the order of the stimulus files. The error is 
+            None if the run succeeded, and a message otherwise.
+        """
+        if output_filenames is None:
+            output_filenames = [re.sub('\\.in$', '', filename) + '.out'
+                                for filename in stimulus_filenames]
+        if len(output_filenames) != len(stimulus_filenames):
+            raise ValueError('Need one output file per stimulus file')
+        tasks = list(zip(stimulus_filenames, output_filenames))
+        
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes <= 1:
+            return [_run_batch_task(self.compiled, task) for task in tasks]
+        
+        pool = multiprocessing.Pool(processes, _start_batch_worker,
+                                    (self.compiled,))
+        try:
+            return pool.map(_run_batch_worker_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+# The CompiledCircuit simulated by a BatchSimulation worker process.
+_batch_compiled = None
+
+def _start_batch_worker(compiled):
+    # Initializes a BatchSimulation worker process.
+    global _batch_compiled
+    _batch_compiled = compiled
+
+def _run_batch_worker_task(task):
+    # Runs one stimulus of a BatchSimulation in a worker process.
+    return _run_batch_task(_batch_compiled, task)
+
+def _run_batch_task(compiled, task):
+    # Runs one stimulus of a BatchSimulation, writing the probe results.
+    (stimulus_filename, output_filename) = task
+    try:
+        reader = NetlistReader()
+        with open(stimulus_filename) as stimulus_file:
+            reader.parse_file(stimulus_file)
+        simulation = CompiledSimulation(compiled)
+        parser = NetlistParser(simulation)
+        for (line_number, command) in reader.stimulus:
+            parser.parse_command(line_number, command)
+        simulation.run()
+        with open(output_filename, 'w') as output_file:
+            simulation.outputs_to_file(output_file)
+    except (EnvironmentError, ValueError) as error:
+        return (stimulus_filename, output_filename, str(error))
+    return (stimulus_filename, output_filename, None)
+
+class BitParallelSimulation:
+    """Zero-delay simulation of many input vectors at once.
+    
+    Each gate's value is a WORD_SIZE-bit integer whose bit i is the gate's
+    output under input vector i, and truth tables are applied to whole words
+    with bitwise operations. Gates are added to a circuit after the gates 
+    feeding them, so a single pass over Circuit.gate_list, in order, computes
+    the settled output of every gate under WORD_SIZE vectors.
+    
+    An input vector gives the values of the circuit's input gates (the gates 
+    without connected inputs). The settled outputs are the values that 
+    Simulation ends with when it starts from a consistent state, i.e. one where
+    every gate's output matches its truth table. (A Simulation only evaluates
+    a gate when one of its inputs changes, so gates that never see a change
+    keep their initial outputs; settle() makes the initial state consistent.)
+    """
+    
+    # The number of input vectors evaluated by one pass over the circuit.
+    WORD_SIZE = 64
+    
+    def __init__(self, circuit):
+        """Creates a simulation that will run on a completely built circuit.
+        
+        Args:
+            circuit: The circuit whose settled outputs will be computed.
+        """
+        self.circuit = circuit
+        self.gates = circuit.gate_list
+        self.numbers = dict((self.gates[i].name, i)
+                            for i in xrange(len(self.gates)))
+    
+    def evaluate_words(self, words, mask=None):
+        """Computes the settled output words of every gate.
+        
+        Args:
+            words: Maps the names of input gates to their value words. Input
+                gates that are not listed keep their current outputs, in every
+                vector.
+            mask: The bits used in the words; by default, the low WORD_SIZE
+                bits.
+        
+        Returns:
+            A list holding every gate's output word, indexed like the gates in
+            Circuit.gate_list.
+        """
+        if mask is None:
+            mask = (1 << self.WORD_SIZE) - 1
+        numbers = self.numbers
+        values = [0] * len(self.gates)
+        for number in xrange(len(self.gates)):
+            gate = self.gates[number]
+            if gate.name in words:
+                values[number] = words[gate.name] & mask
+            elif not gate.has_inputs_connected():
+                values[number] = mask if gate.output else 0
+            else:
+                table = gate.gate_type.truth_table
+                inputs = [values[numbers[in_gate.name]]
+                          for in_gate in gate.in_gates]
+                values[number] = self._apply_table(table.bits,
+                                                   table.input_count, inputs,
+                                                   0, mask)
+        return values
+    
+    def evaluate(self, vectors):
+        """Computes the settled outputs of the probed gates for input vectors.
+        
+        The vectors are evaluated WORD_SIZE at a time.
+        
+        Args:
+            vectors: A list of input vectors, each a dictionary mapping the 
+                names of input gates to their values (0 or 1). Input gates that
+                are not listed keep their current outputs.
+        
+        Returns:
+            A list with a dictionary for every vector, mapping the names of 
+            the probed gates to their settled outputs.
+        """
+        probed = [number for number in xrange(len(self.gates))
+                  if self.gates[number].probed]
+        results = []
+        for start in xrange(0, len(vectors), self.WORD_SIZE):
+            chunk = vectors[start:start + self.WORD_SIZE]
+            words = {}
+            for i in xrange(len(chunk)):
+                for (name, value) in chunk[i].items():
+                    if name not in words:
+                        # Vectors that do not list the gate use its output.
+                        words[name] = (((1 << len(chunk)) - 1) if
+                                       self.gates[self.numbers[name]].output
+                                       else 0)
+                    if value:
+                        words[name] |= 1 << i
+                    else:
+                        words[name] &= ~(1 << i)
+            values = self.evaluate_words(words, (1 << len(chunk)) - 1)
+            for i in xrange(len(chunk)):
+                results.append(dict((self.gates[number].name,
+                                     (values[number] >> i) & 1)
+                                    for number in probed))
+        return results
+    
+    def settle(self):
+        """Sets every gate's output to its settled value.
+        
+        The settled values are computed from the current outputs of the input
+        gates. Afterwards, the circuit's state is consistent.
+        """
+        values = self.evaluate_words({}, 1)
+        for number in xrange(len(self.gates)):
+            self.gates[number].output = values[number]
+    
+    @staticmethod
+    def vector_from_transitions(in_transitions):
+        """The input vector that a Simulation's initial transitions end with.
+        
+        Args:
+            in_transitions: The in_transitions list of a Simulation.
+        
+        Returns:
+            A dictionary mapping the names of the flipped gates to the value
+            of the last transition that Simulation.run() would apply to them.
+        """
+        vector = {}
+        for in_transition in sorted(in_transitions):
+            vector[in_transition[1]] = in_transition[2]
+        return vector
+    
+    def _apply_table(self, bits, count, inputs, first, mask):
+        # Applies a packed truth table to input words by Shannon expansion on 
+        # inputs[first]: the output is the table's upper half applied to the 
+        # remaining inputs where that input is 1, and its lower half where it
+        # is 0. Halves that are all 0s or all 1s need no further expansion.
+        if count == first:
+            return mask if bits & 1 else 0
+        half = 1 << (count - first - 1)
+        low = bits & ((1 << half) - 1)
+        high = bits >> half
+        if low == high:
+            return self._apply_table(low, count, inputs, first + 1, mask)
+        word = inputs[first]
+        return ((word & self._apply_table(high, count, inputs, first + 1, mask))
+                | (~word & mask &
+                   self._apply_table(low, count, inputs, first + 1, mask)))
+
 # Command-line controller.
 if __name__ == '__main__':
     import sys
-    sim = Simulation.from_file(sys.stdin)
+    # CHECKPOINT is the path of a checkpoint file for long simulations. It is
+    # ignored when TRACE=jsonp. CHECKPOINT_SECONDS is the time between
+    # checkpoints; see Simulation.run before making it much shorter than 60.
+    checkpoint = os.environ.get('CHECKPOINT')
     if os.environ.get('TRACE') == 'jsonp':
-        sim.layout_from_file(sys.stdin)
-        sim.probe_all_gates()
-    sim.run()
-    if os.environ.get('TRACE') == 'jsonp':
-        sim.undo_probe_all_gates()
-        sim.jsonp_to_file(sys.stdout)
+        checkpoint = None
+    # The compiled simulation loaded from CIRCUIT_CACHE has no event queue to
+    # choose or profile, so QUEUE and PROFILE bypass the cache.
+    if (os.environ.get('CIRCUIT_CACHE') is not None and
+            os.environ.get('TRACE') != 'jsonp' and checkpoint is None and
+            os.environ.get('QUEUE') is None and
+            os.environ.get('PROFILE') is None):
+        sim = NetlistCache(os.environ['CIRCUIT_CACHE']).load_simulation(
+            sys.stdin)
     else:
+        sim = Simulation.from_file(sys.stdin, os.environ.get('QUEUE', 'heap'))
+        if os.environ.get('PROFILE') is not None:
+            sim.profiler = SimulationProfiler()
+    if checkpoint is not None:
+        # The simulation resumes from the checkpoint if there is one. Probe 
+        # results are kept in memory, so that they can be checkpointed.
+        if os.path.exists(checkpoint):
+            with open(checkpoint, 'rb') as file:
+                sim.load_checkpoint(file)
+        sim.run(checkpoint, float(os.environ.get('CHECKPOINT_SECONDS', 60)))
         sim.outputs_to_file(sys.stdout)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    else:
+        # Probe results are written out as the simulation produces them.
+        if os.environ.get('TRACE') == 'jsonp':
+            sim.layout_from_file(sys.stdin)
+            writer = sim.stream_jsonp_to_file(sys.stdout)
+            sim.probe_all_gates()
+        else:
+            writer = ProbeWriter(sys.stdout)
+            sim.stream_probes(writer)
+        sim.run()
+        writer.close()
+    if os.environ.get('TRACE') == 'jsonp':
+        sim.undo_probe_all_gates()
+    if os.environ.get('PROFILE') is not None:
+        # PROFILE is the path prefix of the profiling reports.
+        prefix = os.environ['PROFILE']
+        with open(prefix + '.json', 'w') as file:
+            sim.profiler.to_json_file(file)
+        with open(prefix + '-gates.csv', 'w') as file:
+            sim.profiler.gates_to_csv(file)
+        with open(prefix + '-steps.csv', 'w') as file:
+            sim.profiler.steps_to_csv(file)
 
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 import unittest
+import io
+import shutil
 import sys
+import tempfile
 import glob
 import re
 from circuit import *
@@ -13,6 +16,10 @@ class CircuitTest(unittest.TestCase):
         self._in_files = glob.glob(os.path.join(dir, 'tests', '*.in'))
         self._in_files.sort()
     
+    def _test_file(self, name):
+        # The path of a file in the tests directory.
+        return os.path.join(os.path.dirname(__file__), 'tests', name)
+    
     def _cmp_files(self, file, lines):
         for line in lines:
             if line != file.readline().strip():
@@ -29,7 +36,7 @@ class CircuitTest(unittest.TestCase):
                 sim.run()
                 out_lines = sim.outputs_to_line_list()
                
-                gold_filename = re.sub('\.in$', '.gold', in_filename)
+                gold_filename = re.sub(r'\.in$', '.gold', in_filename)
                 with open(gold_filename) as gold_file:
                     same = self._cmp_files(gold_file, out_lines)
                     if same:
@@ -37,6 +44,290 @@ class CircuitTest(unittest.TestCase):
                     else: 
                         print ('Failed')
                     self.assertTrue(same)
+
+    def _check_gold_files(self, title, make_simulation):
+        # Runs the simulation made by make_simulation(in_file) for every test
+        # input that has a gold file, and compares its results with the file.
+        print (title)
+        for in_filename in self._in_files:
+            gold_filename = re.sub(r'\.in$', '.gold', in_filename)
+            if not os.path.exists(gold_filename):
+                continue
+            print ('Testing {0} ......'.format(os.path.basename(in_filename))),
+            sys.stdout.flush()
+            with open(in_filename) as in_file:
+                sim = make_simulation(in_file)
+            sim.run()
+            with open(gold_filename) as gold_file:
+                same = self._cmp_files(gold_file, sim.outputs_to_line_list())
+            if same:
+                print ('OK')
+            else: 
+                print ('Failed')
+            self.assertTrue(same)
+
+    def testQueueCorrectness(self):
+        for queue in ('heapq', 'calendar'):
+            self._check_gold_files(
+                'Testing {0} event queue correctness:'.format(queue),
+                lambda in_file: Simulation.from_file(in_file, queue))
+
+    def testTransitionCancellation(self):
+        in_filename = self._test_file('7sort128.in')
+        sims = []
+        for cancel_transitions in (False, True):
+            with open(in_filename) as in_file:
+                sim = Simulation.from_file(in_file)
+            sim.cancel_transitions = cancel_transitions
+            sim.run()
+            sims.append(sim)
+        (plain, cancelling) = sims
+        self.assertEqual(plain.outputs_to_line_list(),
+                         cancelling.outputs_to_line_list())
+        plain_stats = plain.queue_stats()
+        stats = cancelling.queue_stats()
+        self.assertEqual(plain_stats['cancelled'], stats['cancelled'])
+        self.assertEqual(plain_stats['queued'],
+                         stats['queued'] + stats['cancelled'])
+        self.assertTrue(stats['high_water_mark'] <
+                        plain_stats['high_water_mark'])
+
+    def testParserEndOfFile(self):
+        sim = Simulation.from_file(io.StringIO(
+            u'table eq 0 1\ntype in eq 0\ngate a in\nflip a 1 5\n\n\n'))
+        self.assertEqual(list(sim.circuit.gates.keys()), ['a'])
+        self.assertEqual(len(sim.in_transitions), 1)
+
+    def testParserLineNumbers(self):
+        try:
+            Simulation.from_file(io.StringIO(
+                u'table eq 0 1\n# comment\ntype in eq 0\ngate a in\n'
+                u'gate b in c\n'))
+        except ValueError as error:
+            self.assertTrue(str(error).startswith('Line 5:'))
+        else:
+            self.fail('ValueError not raised')
+
+    def testParserMemoryMapped(self):
+        in_filename = self._test_file('2gates.in')
+        threshold = NetlistParser.MMAP_THRESHOLD
+        NetlistParser.MMAP_THRESHOLD = 0
+        try:
+            with open(in_filename) as in_file:
+                mapped = Simulation.from_file(in_file)
+                mapped.layout_from_file(in_file)
+        finally:
+            NetlistParser.MMAP_THRESHOLD = threshold
+        with open(in_filename) as in_file:
+            read = Simulation.from_file(in_file)
+            read.layout_from_file(in_file)
+        self.assertEqual(mapped.layout_svg, read.layout_svg)
+        mapped.run()
+        read.run()
+        self.assertEqual(mapped.outputs_to_line_list(),
+                         read.outputs_to_line_list())
+
+    def testNetlistCache(self):
+        in_filename = self._test_file('7sort128.in')
+        gold_filename = self._test_file('7sort128.gold')
+        directory = tempfile.mkdtemp()
+        try:
+            cache = NetlistCache(directory)
+            for run in xrange(2):
+                with open(in_filename) as in_file:
+                    sim = cache.load_simulation(in_file)
+                sim.run()
+                with open(gold_filename) as gold_file:
+                    self.assertTrue(self._cmp_files(gold_file,
+                                                    sim.outputs_to_line_list()))
+            self.assertEqual(cache.misses, 1)
+            self.assertEqual(cache.hits, 1)
+            
+            # A different stimulus for the same netlist uses the same file.
+            with io.open(in_filename) as in_file:
+                text = in_file.read()
+            text = re.sub(r'flip (\S+) (\d) 0', r'flip \1 1 0', text)
+            sim = cache.load_simulation(io.StringIO(text))
+            self.assertEqual(cache.hits, 2)
+            self.assertEqual(len(os.listdir(directory)), 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def testBatchSimulation(self):
+        in_filename = self._test_file('4sort.in')
+        gold_filename = self._test_file('4sort.gold')
+        directory = tempfile.mkdtemp()
+        try:
+            with open(in_filename) as in_file:
+                batch = BatchSimulation.from_file(in_file)
+            out_filenames = [os.path.join(directory, str(i) + '.out')
+                             for i in xrange(3)]
+            results = batch.run([in_filename] * 3, out_filenames, processes=2)
+            self.assertEqual([error for (_, _, error) in results],
+                             [None] * 3)
+            for out_filename in out_filenames:
+                with open(out_filename) as out_file:
+                    out_lines = [line.strip() for line in out_file]
+                with open(gold_filename) as gold_file:
+                    self.assertTrue(self._cmp_files(gold_file, out_lines))
+        finally:
+            shutil.rmtree(directory)
+
+    def testBitParallelSimulation(self):
+        in_filename = self._test_file('7sort128.in')
+        with open(in_filename) as in_file:
+            circuit = Simulation.from_file(in_file).circuit
+        inputs = [gate.name for gate in circuit.gate_list
+                  if not gate.has_inputs_connected()]
+        vectors = [dict((name, (i * 7 + j * 3) % 5 % 2)
+                        for (j, name) in enumerate(inputs))
+                   for i in xrange(BitParallelSimulation.WORD_SIZE + 2)]
+        results = BitParallelSimulation(circuit).evaluate(vectors)
+        self.assertEqual(len(results), len(vectors))
+        
+        for i in (0, 1, BitParallelSimulation.WORD_SIZE + 1):
+            with open(in_filename) as in_file:
+                sim = Simulation.from_file(in_file)
+            BitParallelSimulation(sim.circuit).settle()
+            sim.in_transitions = []
+            for (name, value) in vectors[i].items():
+                sim.add_transition(name, value, 0)
+            sim.run()
+            outputs = dict((gate.name, gate.output)
+                           for gate in sim.circuit.gate_list if gate.probed)
+            self.assertEqual(outputs, results[i])
+
+    def testProfiler(self):
+        in_filename = self._test_file('7sort128.in')
+        gold_filename = self._test_file('7sort128.gold')
+        with open(in_filename) as in_file:
+            sim = Simulation.from_file(in_file)
+        sim.profiler = SimulationProfiler()
+        sim.run()
+        with open(gold_filename) as gold_file:
+            self.assertTrue(self._cmp_files(gold_file,
+                                            sim.outputs_to_line_list()))
+        
+        totals = sim.profiler.totals()
+        stats = sim.queue_stats()
+        self.assertEqual(totals['queued'], stats['queued'])
+        self.assertEqual(totals['cancelled'], stats['cancelled'])
+        self.assertEqual(totals['evaluations'],
+                         totals['queued'] + totals['cancelled'] -
+                         len(sim.in_transitions))
+        self.assertEqual(totals['applied'],
+                         sum(step[2] for step in sim.profiler.steps))
+        self.assertTrue(totals['max_queue_length'] <= stats['high_water_mark'])
+        
+        # Superseded transitions are counted even when they are queued.
+        with open(in_filename) as in_file:
+            uncancelled = Simulation.from_file(in_file)
+        uncancelled.cancel_transitions = False
+        uncancelled.profiler = SimulationProfiler()
+        uncancelled.run()
+        uncancelled_totals = uncancelled.profiler.totals()
+        self.assertEqual(uncancelled_totals['cancelled'],
+                         uncancelled.queue_stats()['cancelled'])
+        self.assertTrue(uncancelled_totals['cancelled'] > 0)
+        self.assertEqual(uncancelled_totals['evaluations'],
+                         uncancelled_totals['queued'] -
+                         len(uncancelled.in_transitions))
+        
+        report = io.StringIO() if sys.version_info >= (3,) else io.BytesIO()
+        sim.profiler.gates_to_csv(report)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(SimulationProfiler.GATE_FIELDS))
+        self.assertEqual(len(lines), len(sim.profiler.gates) + 1)
+
+    def testProbeWriter(self):
+        in_filename = self._test_file('7sort128.in')
+        gold_filename = self._test_file('7sort128.gold')
+        with open(in_filename) as in_file:
+            sim = Simulation.from_file(in_file)
+        output = io.StringIO() if sys.version_info >= (3,) else io.BytesIO()
+        writer = ProbeWriter(output)
+        sim.stream_probes(writer)
+        sim.run()
+        writer.close()
+        with open(gold_filename) as gold_file:
+            self.assertTrue(self._cmp_files(gold_file,
+                                            output.getvalue().splitlines()))
+        self.assertRaises(ValueError, sim.outputs_to_line_list)
+        
+        output = io.StringIO() if sys.version_info >= (3,) else io.BytesIO()
+        writer = ProbeWriter(output, 'json', ']')
+        output.write('[')
+        for probe in [[0, 'b', 1], [0, 'a', 0], [2, 'a', 1]]:
+            writer.append(probe)
+        self.assertRaises(ValueError, writer.append, [1, 'a', 0])
+        writer.close()
+        self.assertEqual(json.loads(output.getvalue()),
+                         [[0, 'a', 0], [0, 'b', 1], [2, 'a', 1]])
+
+    def _fail_after(self, step, count):
+        # Wraps a Simulation's step method so that it fails after count steps,
+        # like a simulation that crashes or is preempted.
+        steps = [0]
+        def failing_step():
+            if steps[0] == count:
+                raise RuntimeError('Simulation stopped')
+            steps[0] += 1
+            return step()
+        return failing_step
+
+    def testCheckpoint(self):
+        in_filename = self._test_file('5devadas13.in')
+        with io.open(in_filename) as in_file:
+            text = in_file.read()
+        complete = Simulation.from_file(io.StringIO(text))
+        complete.run()
+        # The same gate names with different delays make another netlist.
+        retimed = re.sub(r'(?m)^type (\S+) (\S+) 1$', r'type \1 \2 2', text)
+        
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'checkpoint')
+            for queue in sorted(QUEUES):
+                sim = Simulation.from_file(io.StringIO(text), queue)
+                sim.step = self._fail_after(sim.step, 50)
+                self.assertRaises(RuntimeError, sim.run, path, 0)
+                
+                resumed = Simulation.from_file(io.StringIO(text), queue)
+                with open(path, 'rb') as file:
+                    resumed.load_checkpoint(file)
+                resumed.run()
+                self.assertEqual(resumed.outputs_to_line_list(),
+                                 complete.outputs_to_line_list())
+                self.assertEqual(resumed.queue_stats(), complete.queue_stats())
+                
+                with open(path, 'rb') as file:
+                    self.assertRaises(ValueError, resumed.load_checkpoint,
+                                      file)
+                other = Simulation.from_file(io.StringIO(retimed), queue)
+                with open(path, 'rb') as file:
+                    self.assertRaises(ValueError, other.load_checkpoint, file)
+                
+                # A checkpoint that cannot be written leaves no temporary file.
+                other.netlist_hash = None
+                self.assertRaises(ValueError, other.run, path, 0)
+                self.assertEqual(os.listdir(directory), ['checkpoint'])
+        finally:
+            shutil.rmtree(directory)
+
+    def testPackedTruthTable(self):
+        table = TruthTable('mux', [0, 0, 1, 1, 0, 1, 0, 1])
+        self.assertEqual(table.bits, 0xac)
+        for index in xrange(8):
+            inputs = [(index >> 2) & 1, (index >> 1) & 1, index & 1]
+            self.assertEqual(table.output(inputs), table.output_at(index))
+        self.assertEqual(table.output([0, 1, 0]), 1)
+        self.assertEqual(table.output([1, 1, 0]), 0)
+        self.assertRaises(ValueError, table.output, [0, 1])
+
+    def testCompiledCorrectness(self):
+        self._check_gold_files(
+            'Testing compiled simulation correctness:',
+            lambda in_file: Simulation.from_file(in_file).compile())
     
 if __name__ == '__main__':
     unittest.main()